@@ -1,151 +1,972 @@
-import subprocess
 import json
 import re
 import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+import requests
+from requests.adapters import HTTPAdapter
 import google.generativeai as genai
-from config import MODEL
+from config import (
+    MODEL, OLLAMA_URL, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT,
+    REFLECTION_PROVIDERS, REFLECTION_DISPATCH, HEDGE_DEFAULT_DELAY_MS, HEDGE_MIN_SAMPLES,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+)
+from reflection_cache import reflection_scope, lookup as cached_reflection, store as cache_reflection
 
-def _extract_json(text):
-    """Extract JSON from potentially messy text."""
-    match = re.search(r'\{.*\}', text, re.DOTALL)
-    if match:
-        return match.group(0)
-    return None
+_SMART_QUOTES = "\u201c\u201d"
+# Where a JSON object can open: a { followed by a key or its closing brace. Braces in prose
+# ("{the entry") don't match, so they cost nothing to skip.
+_OBJECT_START = re.compile(r'\{\s*["}\u201c\u201d]')
+
+
+def _parsed_objects(out, objects):
+    """
+    Parses objects, [(start, end, nested objects)] spans of out in order, yielding the ones that
+    parse. An object that doesn't parse may still hold ones that do (e.g. it opened with a stray
+    brace), so those are tried instead; the nested object around the error position holds the
+    same error and is descended into without parsing it again, which keeps this linear.
+    """
+    pending = [(start, end, nested, None) for start, end, nested in reversed(objects)]
+    while pending:
+        start, end, nested, error_at = pending.pop()
+        if error_at is None:
+            try:
+                data = json.loads("".join(out[start:end]), strict=False)
+            except json.JSONDecodeError as e:
+                error_at = start + e.pos
+            except (ValueError, RecursionError):
+                # Nested too deeply to decode, let alone be a reflection
+                continue
+            else:
+                yield data
+                continue
+        pending.extend(
+            (s, e, n, error_at if s <= error_at < e else None) for s, e, n in reversed(nested)
+        )
+
+
+def _json_objects(text):
+    """
+    Yields every top-level JSON object in text, parsed, in order, in one pass over it.
+
+    The scan knows about strings and escapes, so braces inside string values don't count and
+    prose or a second object after the first one is never swallowed. A stack holds the open
+    objects and arrays, and every {...} is recorded when it closes. When an object never
+    closes or doesn't parse, the balanced objects inside it are used instead, so nothing is
+    rescanned. Raw control characters (newlines, tabs) inside strings are accepted.
+
+    While copying it repairs what models commonly get wrong: curly quotes used as string
+    delimiters become straight quotes and trailing commas before } or ] are dropped.
+    """
+    match = _OBJECT_START.search(text)
+    while match:
+        out = ["{"]
+        stack = [("{", 0, [])]  # (opener, offset in out, objects closed inside it)
+        closers = None  # characters that end the current string, None outside strings
+        escape = False
+        for i in range(match.start() + 1, len(text)):
+            c = text[i]
+            if closers is not None:
+                if escape:
+                    escape = False
+                    out.append(c)
+                elif c == "\\":
+                    escape = True
+                    out.append(c)
+                elif c in closers:
+                    closers = None
+                    out.append('"')
+                elif c == '"':
+                    # A straight quote inside a string opened with a curly one; one character
+                    # per item keeps offsets in out equal to offsets in the joined text
+                    out.extend('\\"')
+                else:
+                    out.append(c)
+            elif c == '"':
+                closers = '"'
+                out.append(c)
+            elif c in _SMART_QUOTES:
+                closers = _SMART_QUOTES
+                out.append('"')
+            elif c in "{[":
+                stack.append((c, len(out), []))
+                out.append(c)
+            elif c in "}]":
+                while out[-1].isspace():
+                    out.pop()
+                if out[-1] == ",":
+                    out.pop()
+                out.append(c)
+                opener, start, nested = stack.pop()
+                closed = [(start, len(out), nested)] if opener == "{" else nested
+                if stack:
+                    stack[-1][2].extend(closed)
+                else:
+                    yield from _parsed_objects(out, closed)
+                    match = _OBJECT_START.search(text, i + 1)
+                    break
+            else:
+                out.append(c)
+        else:
+            # The outermost object never closed: fall back to the objects closed inside it
+            yield from _parsed_objects(out, [obj for _, _, nested in stack for obj in nested])
+            return
+
+
+class ReflectionFormatError(ValueError):
+    """Model output held JSON, but no object in it matches the reflection schema."""
+
+
+def validate_reflection(data):
+    """
+    Checks a parsed response against the fields the app relies on and normalizes the optional
+    ones: missing followups become [], plain-string follow-ups become {"question": ...}, and
+    a "true"/"false" string safety_flag becomes a bool. Returns the list of problems (empty if
+    the response is usable).
+    """
+    if not isinstance(data, dict):
+        return ["response is not a JSON object"]
+    problems = []
+    for field in ("reflection", "summary"):
+        if not isinstance(data.get(field), str) or not data[field].strip():
+            problems.append(f'"{field}" must be a non-empty string')
+    for field in ("actionable_insight", "tone", "coping_suggestion"):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            problems.append(f'"{field}" must be a string')
+
+    followups = data.get("followups") or []
+    if not isinstance(followups, list):
+        problems.append('"followups" must be a list')
+        followups = []
+    normalized = []
+    for fup in followups:
+        if isinstance(fup, str):
+            fup = {"question": fup, "follow_up": ""}
+        if not isinstance(fup, dict) or not isinstance(fup.get("question"), str):
+            problems.append('each follow-up needs a "question" string')
+            continue
+        normalized.append(fup)
+    data["followups"] = normalized
+
+    flag = data.get("safety_flag", False)
+    if isinstance(flag, str) and flag.strip().lower() in ("true", "false"):
+        data["safety_flag"] = flag.strip().lower() == "true"
+    elif not isinstance(flag, bool):
+        problems.append('"safety_flag" must be true or false')
+    return problems
+
+
+def parse_reflection(text):
+    """
+    Returns the first JSON object in model output that matches the reflection schema.
+    Raises json.JSONDecodeError if the output holds no parseable object and
+    ReflectionFormatError if none of the objects it holds is a valid reflection.
+    """
+    problems = None
+    for data in _json_objects(text):
+        found = validate_reflection(data)
+        if not found:
+            return data
+        problems = problems or found
+    if problems is None:
+        raise json.JSONDecodeError("No JSON object found", text, 0)
+    raise ReflectionFormatError("; ".join(problems))
+
+
+class ProviderError(Exception):
+    """A reflection backend could not produce a response."""
+
+
+class ReflectionProvider:
+    """
+    A backend that turns a prompt into raw model text. Clients are built lazily and then
+    reused for the life of the provider, which lives for the life of the process.
+    model_id names the backend and model, e.g. for cache keys.
+    """
+    name = "provider"
+    model_id = "provider"
+
+    def generate(self, prompt):
+        """Returns the complete response text; raises ProviderError on failure."""
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """Yields the response text in pieces as it is generated; raises ProviderError on failure."""
+        # Backends without streaming deliver everything as one piece
+        yield self.generate(prompt)
+
+
+class OllamaProvider(ReflectionProvider):
+    """
+    Local Ollama server over its REST API. A pooled keep-alive session reuses the TCP
+    connection, the model is asked for JSON output and kept loaded for OLLAMA_KEEP_ALIVE.
+    """
+    name = "ollama"
+
+    def __init__(self, url=OLLAMA_URL, model=OLLAMA_MODEL):
+        self.url = url.rstrip("/")
+        self.model = model
+        self.model_id = f"ollama/{model}"
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+                self._session = session
+            return self._session
+
+    def _post(self, prompt, stream):
+        prompt = _as_prompt(prompt)
+        payload = {
+            "model": self.model,
+            "prompt": prompt.user,
+            "stream": stream,
+            "format": "json",
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+        }
+        if prompt.system:
+            # A fixed system prompt keeps the start of the model's context identical between
+            # requests, so the server reuses its KV cache for that prefix
+            payload["system"] = prompt.system
+        return self._get_session().post(
+            f"{self.url}/api/generate",
+            json=payload,
+            timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT),
+            stream=stream
+        )
+
+    def generate(self, prompt):
+        try:
+            response = self._post(prompt, stream=False)
+            response.raise_for_status()
+            text = response.json().get("response", "").strip()
+        except (requests.RequestException, ValueError) as e:
+            raise ProviderError(str(e)) from e
+        if not text:
+            raise ProviderError("Empty response")
+        return text
+
+    def stream(self, prompt):
+        try:
+            with self._post(prompt, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise ProviderError(chunk["error"])
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+        except (requests.RequestException, ValueError) as e:
+            raise ProviderError(str(e)) from e
+
+
+class GeminiProvider(ReflectionProvider):
+    """
+    Google Gemini. The API key is configured and the GenerativeModel (with its transport)
+    built on first use only, then shared by every request. The prompt's system part is
+    passed as the model's system instruction, so there is one model per system prompt.
+    """
+    name = "gemini"
+
+    def __init__(self, model=MODEL):
+        self.model_name = model
+        self.model_id = f"gemini/{model}"
+        self._models = {}
+        self._configured = False
+        self._lock = threading.Lock()
+
+    def _get_model(self, system):
+        with self._lock:
+            model = self._models.get(system)
+            if model is not None:
+                return model
+            if not self._configured:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise ProviderError("GEMINI_API_KEY environment variable not set.")
+            # A bad model name or an SDK older than 0.5 (no system_instruction: TypeError)
+            # fails here, and callers only expect ProviderError from a backend
+            try:
+                if not self._configured:
+                    genai.configure(api_key=api_key)
+                    self._configured = True
+                model = genai.GenerativeModel(self.model_name, system_instruction=system or None)
+            except Exception as e:
+                raise ProviderError(f"Could not create Gemini model {self.model_name}: {e}") from e
+            self._models[system] = model
+            return model
+
+    def generate(self, prompt):
+        prompt = _as_prompt(prompt)
+        model = self._get_model(prompt.system)
+        try:
+            return model.generate_content(prompt.user).text.strip()
+        except Exception as e:
+            raise ProviderError(str(e)) from e
+
+    def stream(self, prompt):
+        prompt = _as_prompt(prompt)
+        model = self._get_model(prompt.system)
+        try:
+            for chunk in model.generate_content(prompt.user, stream=True):
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            raise ProviderError(str(e)) from e
+
+
+FAKE_REFLECTION = {
+    "reflection": "It sounds like a lot is on your mind. That is a very understandable way to feel.",
+    "summary": "Working through a full day",
+    "actionable_insight": "Write down the one thing you most want to let go of tonight.",
+    "followups": [
+        {"question": "What took most of your energy today?", "follow_up": "Noticing drains helps protect energy."},
+        {"question": "What would make tomorrow a little lighter?", "follow_up": "Small plans reduce uncertainty."},
+    ],
+    "tone": "warm and steady",
+    "safety_flag": False,
+    "coping_suggestion": "Take three slow breaths, making each exhale longer than the inhale.",
+}
+
+
+class FakeProvider(ReflectionProvider):
+    """
+    Offline provider for tests and benchmarks. Returns `response` (dicts are sent as JSON text)
+    after `latency` seconds, streamed in chunk_size-character pieces spread over that time.
+    With fail=True every call raises ProviderError after the latency.
+    """
+
+    def __init__(self, response=None, latency=0.0, chunk_size=4, fail=False, name="fake"):
+        response = FAKE_REFLECTION if response is None else response
+        self.text = response if isinstance(response, str) else json.dumps(response)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.fail = fail
+        self.name = name
+        self.model_id = f"fake/{name}"
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.fail:
+            raise ProviderError(f"{self.name} is configured to fail")
+        return self.text
+
+    def stream(self, prompt):
+        self.calls += 1
+        if self.fail:
+            time.sleep(self.latency)
+            raise ProviderError(f"{self.name} is configured to fail")
+        pieces = [self.text[i:i + self.chunk_size] for i in range(0, len(self.text), self.chunk_size)]
+        for piece in pieces:
+            time.sleep(self.latency / len(pieces))
+            yield piece
+
+
+DISPATCH_POLICIES = ("sequential", "hedged", "race")
+
+PROVIDER_CLASSES = {
+    "ollama": OllamaProvider,
+    "gemini": GeminiProvider,
+}
+
+_providers = None
+_providers_lock = threading.Lock()
+
+
+def get_providers():
+    """Returns the provider chain, built once from config.REFLECTION_PROVIDERS, in fallback order."""
+    global _providers
+    with _providers_lock:
+        if _providers is None:
+            _providers = [PROVIDER_CLASSES[name]() for name in REFLECTION_PROVIDERS]
+        return list(_providers)
+
+
+def set_providers(providers):
+    """
+    Replaces the provider chain, e.g. with [FakeProvider()] for offline tests.
+    None rebuilds the configured chain on next use.
+    """
+    global _providers
+    with _providers_lock:
+        _providers = list(providers) if providers is not None else None
+
+
+def _get_provider(name):
+    for provider in get_providers():
+        if provider.name == name:
+            return provider
+    return PROVIDER_CLASSES[name]()
+
+
+# Latencies kept per provider for its mean/p95 and hedge delay
+_LATENCY_WINDOW = 200
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _ms_summary(values):
+    if not values:
+        return None, None
+    return round(sum(values) / len(values) * 1000, 1), round(_percentile(values, 95) * 1000, 1)
+
+
+class ProviderHealth:
+    """
+    Request counters, recent latencies and a circuit breaker for one provider.
+
+    After CIRCUIT_FAILURE_THRESHOLD consecutive failures the circuit opens and the provider is
+    skipped without sending anything for CIRCUIT_RESET_SECONDS. After that one trial request is
+    let through (half-open): success closes the circuit again, failure re-opens it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.consecutive_failures = 0
+        self.latencies = deque(maxlen=_LATENCY_WINDOW)
+        self.first_chunk = deque(maxlen=_LATENCY_WINDOW)
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _circuit(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < CIRCUIT_RESET_SECONDS:
+            return "open"
+        return "half-open"
+
+    def allow_request(self):
+        """True if a request may be sent now. While half-open only one trial runs at a time."""
+        with self._lock:
+            circuit = self._circuit()
+            if circuit == "closed":
+                return True
+            if circuit == "open" or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self, seconds, first_chunk_seconds=None):
+        with self._lock:
+            self.requests += 1
+            self.consecutive_failures = 0
+            self._opened_at = None
+            self._trial_running = False
+            self.latencies.append(seconds)
+            if first_chunk_seconds is not None:
+                self.first_chunk.append(first_chunk_seconds)
+
+    def record_failure(self):
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self._trial_running or self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def record_cancelled(self):
+        """A request dropped because another provider answered first; counts as neither outcome."""
+        with self._lock:
+            self.requests += 1
+            self.cancelled += 1
+            self._trial_running = False
+
+    def hedge_delay(self, first_chunk=False):
+        """
+        Seconds to give this provider before the next one is started alongside it: its p95
+        latency (to the first streamed chunk if first_chunk is set), or HEDGE_DEFAULT_DELAY_MS
+        until it has HEDGE_MIN_SAMPLES successful requests.
+        """
+        with self._lock:
+            samples = list(self.first_chunk if first_chunk else self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_MS / 1000
+        return _percentile(samples, 95)
+
+    def snapshot(self):
+        with self._lock:
+            info = {
+                "requests": self.requests,
+                "errors": self.errors,
+                "cancelled": self.cancelled,
+                "consecutive_failures": self.consecutive_failures,
+                "circuit": self._circuit(),
+            }
+            latencies, first_chunk = list(self.latencies), list(self.first_chunk)
+        info["mean_ms"], info["p95_ms"] = _ms_summary(latencies)
+        info["first_chunk_mean_ms"] = _ms_summary(first_chunk)[0]
+        return info
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def get_health(name):
+    """Returns the ProviderHealth for a provider name, shared by every request in the process."""
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = _health[name] = ProviderHealth(name)
+        return health
+
+
+def reset_provider_stats():
+    """Forgets all counters, latencies and open circuits, e.g. between benchmark runs."""
+    with _health_lock:
+        _health.clear()
+
+
+def _timed_generate(provider, prompt):
+    health = get_health(provider.name)
+    if not health.allow_request():
+        raise ProviderError("skipped while its circuit is open")
+    start = time.perf_counter()
+    try:
+        text = provider.generate(prompt)
+    except Exception:
+        health.record_failure()
+        raise
+    health.record_success(time.perf_counter() - start)
+    return text
+
+
+def provider_stats():
+    """
+    Returns {provider name: {requests, errors, cancelled, consecutive_failures, circuit, mean_ms,
+    p95_ms, first_chunk_mean_ms}} for this process. Latencies cover successful requests;
+    first_chunk is the time to the first streamed piece.
+    """
+    with _health_lock:
+        health = list(_health.values())
+    return {h.name: h.snapshot() for h in health}
 
 
 def call_ollama(prompt, context=None):
-    """Try local Ollama, return None if unavailable."""
-    combined_prompt = prompt if not context else f"Context:\n{context}\n\nUser:\n{prompt}"
-    
+    """Try local Ollama, return None if unavailable. The context goes before the user part of the prompt."""
+    prompt = _as_prompt(prompt)
+    if context:
+        prompt = prompt._replace(user=f"Context:\n{context}\n\nUser:\n{prompt.user}")
     try:
-        result = subprocess.run(
-            ["ollama", "run", "gemma3:1b"],
-            input=combined_prompt,
-            text=True,
-            capture_output=True,
-            check=True,
-            encoding='utf-8',
-            errors='replace',
-            timeout=30
-        )
-        return result.stdout.strip()
-    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
+        return _timed_generate(_get_provider("ollama"), prompt)
+    except ProviderError:
         return None
 
 
+class JsonFieldStreamer:
+    """
+    Incremental JSON scanner that surfaces one top-level string field while the document is
+    still arriving. feed() takes the next piece of raw model output and returns the newly
+    decoded characters of that field (escapes resolved), so a UI can show a reflection
+    word by word. Anything before the first "{" (e.g. a ```json fence) is ignored.
+    """
+
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field="reflection"):
+        self.field = field
+        self.text = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+        self._high_surrogate = None
+        self._role = None
+        self._expect_key = False
+        self._key = None
+        self._key_chars = []
+
+    def _emit(self, char, out):
+        if self._role == "key":
+            self._key_chars.append(char)
+        elif self._role == "field":
+            out.append(char)
+
+    def feed(self, chunk):
+        out = []
+        for c in chunk:
+            self.text.append(c)
+            if self._in_string:
+                if self._unicode is not None:
+                    self._unicode += c
+                    if len(self._unicode) == 4:
+                        code = int(self._unicode, 16) if all(h in "0123456789abcdefABCDEF" for h in self._unicode) else 0xFFFD
+                        self._unicode = None
+                        if 0xD800 <= code < 0xDC00:
+                            self._high_surrogate = code
+                            continue
+                        if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                        self._high_surrogate = None
+                        self._emit(chr(code), out)
+                elif self._escape:
+                    self._escape = False
+                    if c == "u":
+                        self._unicode = ""
+                    else:
+                        self._emit(self._ESCAPES.get(c, c), out)
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._role == "key":
+                        self._key = "".join(self._key_chars)
+                    self._role = None
+                else:
+                    self._emit(c, out)
+            elif c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._role = "key"
+                    self._key_chars = []
+                elif self._depth == 1 and self._key == self.field:
+                    self._role = "field"
+                else:
+                    self._role = None
+            elif c in "{[":
+                self._depth += 1
+                self._expect_key = self._depth == 1 and c == "{"
+            elif c in "}]":
+                self._depth -= 1
+            elif self._depth == 1 and c == ":":
+                self._expect_key = False
+            elif self._depth == 1 and c == ",":
+                self._expect_key = True
+                self._key = None
+        return "".join(out)
+
+    def result(self):
+        """Parses the complete output with parse_reflection(), raising its errors."""
+        return parse_reflection("".join(self.text))
+
+
 def call_gemini(prompt):
     """Call Google Gemini API."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        return {"error": "GEMINI_API_KEY environment variable not set."}
-
-    genai.configure(api_key=api_key)
-    
     try:
-        model = genai.GenerativeModel("models/gemini-2.5-flash")
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        json_str = _extract_json(response_text)
-        if json_str:
-            return json.loads(json_str)
-        else:
-            return json.loads(response_text)
-    except json.JSONDecodeError as e:
+        response_text = _timed_generate(_get_provider("gemini"), prompt)
+        return parse_reflection(response_text)
+    except ValueError as e:
         return {"error": f"Failed to parse response: {e}"}
-    except Exception as e:
+    except ProviderError as e:
         return {"error": f"Failed to get response from Gemini: {e}"}
 
 
+# Bump when build_contextual_prompt's wording changes; cached reflections from other versions are not reused
+PROMPT_TEMPLATE_VERSION = 2
+
+TONE_INSTRUCTIONS = {
+    "very_negative": "Use an extra compassionate, grounding tone. Focus on safety and immediate coping.",
+    "negative": "Use a warm, validating tone. Help them see small positive steps they can take.",
+    "neutral": "Use a balanced, curious tone. Help them explore what they're experiencing.",
+    "positive": "Use an encouraging, reinforcing tone. Help them build on this positive momentum.",
+}
+
+
+def prompt_band(sentiment):
+    """The sentiment band that sets the prompt's tone: below -0.7, below -0.3, below 0.3, or above."""
+    if sentiment < -0.7:
+        return "very_negative"
+    if sentiment < -0.3:
+        return "negative"
+    if sentiment < 0.3:
+        return "neutral"
+    return "positive"
+
+
+# Sent as the system prompt, identical for every request, so Ollama can reuse the KV cache
+# for it and Gemini receives it as its system instruction
+SYSTEM_PROMPT = """You are a compassionate, non-judgmental emotional support companion. Your role is to help users reflect deeply on their emotions and find actionable insights.
+
+Reply with a single JSON object and no other text, with these fields:
+- "reflection": 3-4 empathetic sentences that validate their feelings and show you understand and feel with them. If sentiment is very low, include a grounding element.
+- "summary": one line capturing the core emotion or theme.
+- "actionable_insight": one brief, practical step they could try to refresh their mind (not therapy advice).
+- "followups": two objects {"question": "...", "follow_up": "..."}. The first question is tailored to their situation and emotion, the second explores what led to this or what could help them move forward; "follow_up" says why the question matters for their growth.
+- "tone": the tone you used, e.g. "calm and grounding, gently refocusing".
+- "safety_flag": true or false.
+- "coping_suggestion": a grounding or coping technique if sentiment is below -0.3, otherwise "".
+
+Each entry comes with the tone and follow-up focus to use."""
+
+# Follow-up focus per emotion; other emotions get none
+FOLLOWUP_FOCUS = {
+    "lonely": "Focus follow-ups on connection: relationships, reaching out, community.",
+    "anxious": "Focus follow-ups on breaking things down into manageable steps and grounding techniques.",
+    "overwhelmed": "Focus follow-ups on breaking things down into manageable steps and grounding techniques.",
+    "ashamed": "Focus follow-ups on self-compassion and processing feelings.",
+    "grieving": "Focus follow-ups on self-compassion and processing feelings.",
+    "joyful": "Focus follow-ups on sustaining this momentum and understanding what contributed.",
+    "hopeful": "Focus follow-ups on sustaining this momentum and understanding what contributed.",
+    "frustrated": "Focus follow-ups on understanding the source and healthy expression.",
+    "angry": "Focus follow-ups on understanding the source and healthy expression.",
+}
+
+
+def _compile_guidance():
+    """Tone and follow-up instructions for every (sentiment band, emotion) pair; emotion None is the fallback."""
+    guidance = {}
+    for band, tone in TONE_INSTRUCTIONS.items():
+        guidance[(band, None)] = tone
+        for emotion, focus in FOLLOWUP_FOCUS.items():
+            guidance[(band, emotion)] = f"{tone}\n{focus}"
+    return guidance
+
+
+_GUIDANCE = _compile_guidance()
+
+
+class Prompt(namedtuple("Prompt", ["system", "user"])):
+    """A prompt split into the static system part, shared by all requests, and the per-entry user part."""
+    __slots__ = ()
+
+    @property
+    def text(self):
+        """Both parts as one string, for backends without a separate system prompt."""
+        return f"{self.system}\n\n{self.user}" if self.system else self.user
+
+
+def _as_prompt(prompt):
+    return prompt if isinstance(prompt, Prompt) else Prompt("", prompt)
+
+
 def build_contextual_prompt(user_input, emotion, sentiment, past_patterns=None):
     """
     Builds a smarter prompt based on detected emotion and sentiment.
     Includes context-specific follow-up questions.
+    Returns a Prompt: the instructions and response format are the static SYSTEM_PROMPT; only
+    the precompiled tone/follow-up guidance, the emotion and the entry change per request.
     """
-    
-    # Determine prompt style based on emotion/sentiment
-    if sentiment < -0.7:
-        tone_instruction = "Use an extra compassionate, grounding tone. Focus on safety and immediate coping."
-    elif sentiment < -0.3:
-        tone_instruction = "Use a warm, validating tone. Help them see small positive steps they can take."
-    elif sentiment < 0.3:
-        tone_instruction = "Use a balanced, curious tone. Help them explore what they're experiencing."
-    else:
-        tone_instruction = "Use an encouraging, reinforcing tone. Help them build on this positive momentum."
-    
-    # Context-specific follow-ups
-    followup_context = ""
-    if emotion.lower() == "lonely":
-        followup_context = "Focus follow-ups on connection: relationships, reaching out, community."
-    elif emotion.lower() == "anxious" or emotion.lower() == "overwhelmed":
-        followup_context = "Focus follow-ups on breaking things down into manageable steps and grounding techniques."
-    elif emotion.lower() == "ashamed" or emotion.lower() == "grieving":
-        followup_context = "Focus follow-ups on self-compassion and processing feelings."
-    elif emotion.lower() == "joyful" or emotion.lower() == "hopeful":
-        followup_context = "Focus follow-ups on sustaining this momentum and understanding what contributed."
-    elif emotion.lower() == "frustrated" or emotion.lower() == "angry":
-        followup_context = "Focus follow-ups on understanding the source and healthy expression."
-    
-    prompt = f"""
-You are a compassionate, non-judgmental emotional support companion. Your role is to help users reflect deeply on their emotions and find actionable insights.
-
-{tone_instruction}
+    band = prompt_band(sentiment)
+    guidance = _GUIDANCE.get((band, emotion.lower())) or _GUIDANCE[(band, None)]
+    user = f"""{guidance}
 
 User's emotional state: {emotion} (sentiment score: {sentiment:.2f})
-{followup_context}
 
 User's journal entry:
-\"\"\"{user_input}\"\"\"
-
-Generate a helpful response with this exact JSON format (no extra text):
-
-{{
-  "reflection": "A 3-4 sentence empathetic reflection that validates their feelings , shows you understand and also do join them in their emotions . If sentiment is very low, include a grounding element.",
-  "summary": "One-line summary capturing the core emotion/theme.",
-  "actionable_insight": "A brief, practical suggestion they could try (not therapy advice, just small actionable steps which could improve or refresh their mind and fresehn them up').",
-  "followups": [
-    {{
-      "question": "A deeply thoughtful follow-up question tailored to their specific situation and emotion",
-      "follow_up": "Why this question matters for their emotional growth"
-    }},
-    {{
-      "question": "A second follow-up that explores either what led to this or what could help them move forward",
-      "follow_up": "The psychological principle or insight behind this question"
-    }}
-  ],
-  "tone": "Description of the tone used (e.g., warm and grounding, gently challenging, celebratory)",
-  "safety_flag": true/false,
-  "coping_suggestion": "If sentiment < -0.3: suggest a grounding or coping technique "
-}}
-
-Example for anxious entry:
-{{
-  "reflection": "It sounds like you're caught in a cycle of worry and uncertainty. That's a completely understandable response to feeling out of control.",
-  "summary": "Overwhelmed by things beyond your control",
-  "actionable_insight": "Try identifying just one thing you CAN control today and focus on that for 10 minutes",
-  "followups": [
-    {{
-      "question": "What's one small thing that's actually within your control right now?",
-      "follow_up": "Helps shift focus from overwhelming unknowns to what you can influence"
-    }},
-    {{
-      "question": "When did this feeling start, and was there a specific trigger?",
-      "follow_up": "Understanding the origin helps address the root cause vs. just the symptoms"
-    }}
-  ],
-  "tone": "calm and grounding, gently refocusing",
-  "safety_flag": false,
-  "coping_suggestion": "Try the 5-4-3-2-1 grounding technique: name 5 things you see, 4 you hear, 3 you touch, 2 you smell, 1 you taste"
-}}
-"""
+\"\"\"{user_input}\"\"\""""
+    return Prompt(SYSTEM_PROMPT, user)
+
+
+# Word pieces of up to 4 characters and single punctuation marks, roughly what subword
+# tokenizers produce for English text
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Approximate token count of text, for comparing prompt sizes without a model tokenizer."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def prompt_tokens(prompt):
+    """
+    Returns approximate token counts {"system", "user", "total"} for a prompt. With the system
+    part cached by the backend, only "user" tokens are processed afresh on each request.
+    """
+    prompt = _as_prompt(prompt)
+    system, user = estimate_tokens(prompt.system), estimate_tokens(prompt.user)
+    return {"system": system, "user": user, "total": system + user}
+
+
+class _Attempt:
+    """One provider's streamed request, run on its own thread and reported to a shared queue."""
+
+    def __init__(self, provider, prompt, events):
+        self.provider = provider
+        self.health = get_health(provider.name)
+        self.started = time.monotonic()
+        self.text = ""
+        self._prompt = prompt
+        self._events = events
+        self._cancelled = threading.Event()
+        threading.Thread(target=self._run, name=f"reflection-{provider.name}", daemon=True).start()
+
+    def cancel(self):
+        """Stops the attempt at its next chunk, which closes the provider's stream."""
+        self._cancelled.set()
+
+    def _run(self):
+        streamer = JsonFieldStreamer("reflection")
+        start = time.perf_counter()
+        first_chunk = None
+        chunks = self.provider.stream(self._prompt)
+        try:
+            for chunk in chunks:
+                if self._cancelled.is_set():
+                    self.health.record_cancelled()
+                    return
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                delta = streamer.feed(chunk)
+                if delta:
+                    self._events.put((self, "delta", delta))
+            result = streamer.result()
+        except ValueError as e:
+            self.health.record_failure()
+            self._events.put((self, "error", f"Failed to parse response from {self.provider.name}: {e}"))
+            return
+        except Exception as e:
+            self.health.record_failure()
+            self._events.put((self, "error", f"Failed to get response from {self.provider.name}: {e}"))
+            return
+        finally:
+            chunks.close()
+        self.health.record_success(time.perf_counter() - start, first_chunk)
+        self._events.put((self, "done", result))
+
+
+def _dispatch(prompt, policy=None, stream=True):
+    """
+    Runs prompt against get_providers() under a dispatch policy (default REFLECTION_DISPATCH)
+    and yields stream_reflection's events; with stream=False only the final ("done", ...) is.
+
+      "sequential" - the next provider starts only once the previous one has failed
+      "hedged"     - the next provider also starts when the current one hasn't answered (or, when
+                     streaming, shown any text) within its p95 latency
+      "race"       - every provider starts at once
+
+    The first valid JSON response wins and the other attempts are cancelled. Providers whose
+    circuit is open are skipped without a request. While streaming, the text shown is that of
+    the first attempt to produce some; if it fails or another attempt wins, a "reset" is sent
+    and the text of the attempt that takes over is replayed.
+    """
+    policy = policy or REFLECTION_DISPATCH
+    if policy not in DISPATCH_POLICIES:
+        raise ValueError(f"Unknown dispatch policy '{policy}', expected one of {DISPATCH_POLICIES}")
+
+    pending = get_providers()
+    events = queue.Queue()
+    running = []
+    leader = None
+    error = {"error": "No reflection provider is available."}
+
+    def launch_next():
+        while pending:
+            provider = pending.pop(0)
+            if get_health(provider.name).allow_request():
+                running.append(_Attempt(provider, prompt, events))
+                return True
+            print(f"⚠️ Skipping {provider.name}: circuit open after repeated failures")
+        return False
+
+    launch_next()
+    if policy == "race":
+        while launch_next():
+            pass
+
+    try:
+        while running:
+            timeout = None
+            if policy == "hedged" and pending and leader is None:
+                newest = running[-1]
+                deadline = newest.started + newest.health.hedge_delay(first_chunk=stream)
+                timeout = max(0.0, deadline - time.monotonic())
+            try:
+                attempt, kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                print(f"⚠️ {running[-1].provider.name} is slower than usual, also starting the next provider")
+                launch_next()
+                continue
+
+            if kind == "delta":
+                if stream:
+                    attempt.text += value
+                    if leader is None:
+                        leader = attempt
+                    if attempt is leader:
+                        yield "delta", value
+                continue
+
+            running.remove(attempt)
+            if kind == "done":
+                if stream and attempt is not leader:
+                    if leader is not None:
+                        yield "reset", None
+                    if attempt.text:
+                        yield "delta", attempt.text
+                print(f"✓ Reflection from {attempt.provider.name}\n")
+                yield "done", value
+                return
+
+            error = {"error": value}
+            print(f"⚠️ {value}")
+            if attempt is leader:
+                yield "reset", None
+                leader = next((other for other in running if other.text), None)
+                if leader is not None:
+                    yield "delta", leader.text
+            if not running:
+                launch_next()
+    finally:
+        for attempt in running:
+            attempt.cancel()
+
+    yield "done", error
+
+
+def _cached_dispatch(user_input, emotion, sentiment, prompt, stream=True):
+    """
+    _dispatch() behind the reflection cache. A hit is replayed as a single delta and "done";
+    successful responses are stored along with how long they took to generate.
+    """
+    scope = reflection_scope(
+        emotion, prompt_band(sentiment), "+".join(p.model_id for p in get_providers()), PROMPT_TEMPLATE_VERSION
+    )
+    cached = cached_reflection(user_input, scope)
+    if cached is not None:
+        print("✓ Reflection from cache\n")
+        if stream and cached.get("reflection"):
+            yield "delta", cached["reflection"]
+        yield "done", cached
+        return
+
+    start = time.perf_counter()
+    for event, value in _dispatch(prompt, stream=stream):
+        if event == "done" and "error" not in value:
+            cache_reflection(user_input, scope, value, (time.perf_counter() - start) * 1000)
+        yield event, value
+
+
+def stream_reflection(user_input, emotion=None, sentiment=None, past_patterns=None):
+    """
+    Streaming version of generate_reflection. Yields (event, value) pairs:
+      ("delta", text)  - the next characters of the "reflection" field, as they are generated
+      ("reset", None)  - the text shown so far is void (its backend failed or another one answered first)
+      ("done", result) - the parsed response dict, or {"error": ...} like generate_reflection
+    Providers are dispatched by config.REFLECTION_DISPATCH; see _dispatch().
+    """
+    if emotion is None or sentiment is None:
+        from emotion_analysis import analyze_emotion
+        sentiment, emotion = analyze_emotion(user_input)
     
-    return prompt
+    prompt = build_contextual_prompt(user_input, emotion, sentiment, past_patterns)
+    
+    yield from _cached_dispatch(user_input, emotion, sentiment, prompt)
 
 
 def generate_reflection(user_input, emotion=None, sentiment=None, past_patterns=None):
     """
     Generates contextual reflection with smart follow-ups based on emotion.
-    Falls back to Gemini if Ollama unavailable.
+    Providers (Ollama, then Gemini by default) are dispatched by config.REFLECTION_DISPATCH.
     """
     # If emotion/sentiment not provided, analyze them first
     if emotion is None or sentiment is None:
@@ -156,20 +977,8 @@ def generate_reflection(user_input, emotion=None, sentiment=None, past_patterns=
     
     print("\n🧠 Generating empathetic reflection...\n")
     
-    # Try Ollama first
-    response = call_ollama(prompt)
-    
-    if response:
-        print("✓ Using local Ollama model\n")
-        try:
-            json_str = _extract_json(response)
-            if not json_str:
-                raise json.JSONDecodeError("No JSON found", response, 0)
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            print("⚠️ Ollama returned invalid JSON. Falling back to Gemini...")
-    
-    # Fall back to Gemini
-    print("✓ Using Google Gemini API\n")
-    return call_gemini(prompt)
-
+    result = {"error": "No response received."}
+    for event, value in _cached_dispatch(user_input, emotion, sentiment, prompt, stream=False):
+        if event == "done":
+            result = value
+    return result
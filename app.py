@@ -7,13 +7,24 @@ import numpy as np
 import os
 from datetime import timedelta
 
-from config import MODEL, COPING_STRATEGIES, CRISIS_RESOURCES
-from database import init_db, insert_entry, load_entries
-from ai_engine import generate_reflection
-from emotion_analysis import analyze_emotion, get_emotion_category, get_emotion_severity
+from config import MODEL, COPING_STRATEGIES, CRISIS_RESOURCES, WARM_UP_MODELS, SEARCH_PAGE_SIZE
+from database import (
+    init_db, load_entries, analysis_cache_stats, search_entries, get_emotion_options,
+    data_version, get_aggregates
+)
+from data_cache import cached, cache_stats
+from charts import render_sentiment_chart
+from ai_engine import provider_stats
+from emotion_analysis import (
+    get_emotion_category, get_emotion_severity, warm_up_emotion_classifier
+)
+from model_registry import model_stats
+from journal_pipeline import JournalSubmission, pipeline_stats
+from reflection_cache import reflection_cache_stats
 from utils import (
-    crisis_detect, get_similar_entries, get_emotion_patterns, 
-    get_sentiment_trends, get_emotion_triggers, get_low_sentiment_context
+    get_low_sentiment_context,
+    get_emotion_patterns_from_aggregates, get_emotion_triggers_from_aggregates,
+    transition_matrix_from_aggregates
 )
 
 import google.generativeai as genai
@@ -125,30 +136,57 @@ st.markdown("""
 genai.api_key = os.getenv("GEMINI_API_KEY")
 init_db()
 
+# Start loading the emotion model in the background so the first entry doesn't pay for it.
+# This is a no-op once the model is loaded or while a warm-up is already running.
+if WARM_UP_MODELS:
+    warm_up_emotion_classifier()
+
+
+def load_timeline():
+    """Timestamp, sentiment and emotion of every entry, oldest first, with parsed timestamps."""
+    df = load_entries(columns=["timestamp", "sentiment", "emotion"], ascending=True)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601")
+    return df
+
+
+def load_recent_table(n=10):
+    display_columns = ["timestamp", "emotion", "sentiment", "summary"]
+    display_df = load_entries(columns=display_columns, limit=n)[display_columns]
+    display_df["timestamp"] = pd.to_datetime(display_df["timestamp"], format="ISO8601").dt.strftime("%b %d, %Y")
+    display_df["sentiment"] = display_df["sentiment"].round(2)
+    return display_df
+
+
+# Everything derived from the journal below is cached until an entry is saved or re-analyzed.
+# Cached frames are shared between sessions, so they are never modified in place.
+data_ver = data_version()
+
 # ============================
 # SIDEBAR DASHBOARD
 # ============================
 with st.sidebar:
     st.markdown("### 📊 Dashboard")
-    df_sidebar = load_entries()
+    aggregates = cached("aggregates", get_aggregates, data_ver)
+    sidebar_patterns = get_emotion_patterns_from_aggregates(aggregates)
     
-    if df_sidebar.empty:
+    if not sidebar_patterns:
         st.info("No entries yet. Start journaling to see insights!")
     else:
-        df_sidebar["timestamp"] = pd.to_datetime(df_sidebar["timestamp"])
-        
+        emotion_frequency = sidebar_patterns["emotion_frequency"]
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("📝 Entries", len(df_sidebar))
-            st.metric("🙂 Avg Sentiment", round(df_sidebar["sentiment"].mean(), 2))
+            st.metric("📝 Entries", sidebar_patterns["total_entries"])
+            st.metric("🙂 Avg Sentiment", round(sidebar_patterns["sentiment_stats"]["average"], 2))
         with col2:
-            most_common_emotion = df_sidebar["emotion"].mode()[0] if not df_sidebar["emotion"].mode().empty else "N/A"
+            most_common_emotion = next(iter(emotion_frequency), "N/A")
             st.metric("💖 Top Emotion", most_common_emotion)
-            positive = len(df_sidebar[df_sidebar["sentiment"] > 0.3])
+            positive = sum(bands.get("positive", 0) for bands in aggregates["emotion_bands"].values())
             st.metric("📈 Positive", positive)
 
         st.markdown("---")
-        last_entry = df_sidebar.iloc[0]
+        last_entry = cached(
+            "last_entry", lambda: load_entries(columns=["entry", "emotion"], limit=1), data_ver
+        ).iloc[0]
         last_emotion = last_entry["emotion"]
         emoji = EMOJI_MAP.get(last_emotion.lower(), '')
         st.markdown(f"**Last Entry** {emoji}")
@@ -156,14 +194,65 @@ with st.sidebar:
         
         st.markdown("---")
         st.markdown("### 🔎 Quick Filter")
-        selected_emotion = st.selectbox("By Emotion:", options=["All"] + sorted(df_sidebar["emotion"].unique().tolist()))
+        selected_emotion = st.selectbox("By Emotion:", options=["All"] + sorted(emotion_frequency))
         
         if selected_emotion != "All":
-            filtered_df = df_sidebar[df_sidebar["emotion"] == selected_emotion]
+            filtered_count = emotion_frequency[selected_emotion]
         else:
-            filtered_df = df_sidebar
+            filtered_count = sidebar_patterns["total_entries"]
         
-        st.metric(f"Entries", len(filtered_df))
+        st.metric(f"Entries", filtered_count)
+
+    st.markdown("---")
+    with st.expander("⚙️ Model Status"):
+        stats = model_stats()
+        for name, info in stats["models"].items():
+            if info["loaded"]:
+                backend = f" on {info['backend']}" if info.get("backend") else ""
+                st.caption(f"**{name}**: loaded{backend} in {info['load_seconds']}s, +{info['rss_delta_mb']} MB")
+            else:
+                st.caption(f"**{name}**: not loaded yet")
+        if stats["process_rss_mb"] is not None:
+            st.caption(f"Process memory: {stats['process_rss_mb']:.0f} MB")
+        cache = analysis_cache_stats()
+        st.caption(f"Analysis cache: {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0%})")
+        reflections = reflection_cache_stats()
+        st.caption(
+            f"Reflection cache: {reflections['hits']} hits + {reflections['near_hits']} near-duplicate / "
+            f"{reflections['misses']} misses ({reflections['hit_rate']:.0%}), "
+            f"{reflections['saved_ms'] / 1000:.1f}s of generation saved"
+        )
+        for name, info in provider_stats().items():
+            circuit = "" if info["circuit"] == "closed" else f" — circuit {info['circuit']}"
+            if info["mean_ms"] is None:
+                st.caption(f"**{name}**: {info['errors']}/{info['requests']} requests failed{circuit}")
+                continue
+            first_chunk = f", first text {info['first_chunk_mean_ms']} ms" if info["first_chunk_mean_ms"] else ""
+            st.caption(
+                f"**{name}**: {info['requests']} requests ({info['errors']} failed, {info['cancelled']} cancelled), "
+                f"mean {info['mean_ms']} ms, p95 {info['p95_ms']} ms{first_chunk}{circuit}"
+            )
+
+    with st.expander("⏱️ Submission Timings"):
+        timings = pipeline_stats()
+        if not timings["submissions"]:
+            st.caption("No entries submitted yet.")
+        else:
+            st.caption(f"Mean end-to-end over {timings['submissions']} submissions: {timings['total_ms']} ms")
+            for stage, info in timings["stages"].items():
+                st.caption(f"**{stage}**: starts at {info['start_ms']} ms, takes {info['ms']} ms")
+
+    with st.expander("🐞 Data Cache"):
+        data_cache = cache_stats()
+        st.caption(f"Data version: {data_ver}")
+        st.caption(
+            f"All keys: {data_cache['hits']} hits / {data_cache['misses']} misses ({data_cache['hit_rate']:.0%})"
+        )
+        for key, info in sorted(data_cache["keys"].items()):
+            st.caption(
+                f"**{key}**: {info['hits']}/{info['hits'] + info['misses']} hits ({info['hit_rate']:.0%}), "
+                f"last compute {info['compute_ms']} ms"
+            )
 
 # ============================
 # MAIN TABS
@@ -185,9 +274,9 @@ with tabs[0]:
         if not entry.strip():
             st.warning("Please write something first.")
         else:
-            sentiment, emotion = analyze_emotion(entry)
-            crisis_level = crisis_detect(entry)
-            df_prev = load_entries()
+            submission = JournalSubmission(entry)
+            sentiment, emotion = submission.analysis()
+            crisis_level = submission.crisis()
             
             if crisis_level:
                 st.markdown(f"""
@@ -202,7 +291,7 @@ with tabs[0]:
                 </div>
                 """, unsafe_allow_html=True)
                 
-                insert_entry({
+                submission.save({
                     "timestamp": datetime.datetime.now().isoformat(),
                     "entry": entry,
                     "reflection": f"Crisis support flagged",
@@ -214,61 +303,79 @@ with tabs[0]:
                     "emotion": emotion
                 })
             else:
-                with st.spinner("🧠 Generating personalized reflection..."):
-                    res = generate_reflection(entry, emotion, sentiment)
-                    
-                    if "error" in res:
-                        st.error(res["error"])
+                emoji = EMOJI_MAP.get(emotion.lower(), "")
+                reflection_box = st.empty()
+                reflection_box.caption("🧠 Generating personalized reflection...")
+                # The reflection is rendered as it streams in; the rest needs the complete response
+                streamed = ""
+                res = {"error": "No response received."}
+                for event, value in submission.reflection():
+                    if event == "delta":
+                        streamed += value
+                        reflection_box.markdown(
+                            f"### 💬 {emoji} Reflection\n\n<div class='reflection-output'>\"{streamed}▌\"</div>",
+                            unsafe_allow_html=True
+                        )
+                    elif event == "reset":
+                        streamed = ""
+                        reflection_box.caption("🧠 Generating personalized reflection...")
                     else:
-                        emoji = EMOJI_MAP.get(emotion.lower(), "")
-                        st.markdown(f"### 💬 {emoji} Reflection")
-                        st.markdown(f"<div class='reflection-output fadeIn'>\"{res['reflection']}\"</div>", unsafe_allow_html=True)
-                        
-                        # Metrics
-                        severity = get_emotion_severity(sentiment)
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Emotion", emotion)
-                        with col2:
-                            st.metric("Sentiment", f"{sentiment:.2f}", delta=None)
-                        with col3:
-                            st.metric("Severity", severity)
-                        
-                        # Summary & Actionable Insight
-                        st.info(f"**Summary:** {res['summary']}")
-                        if res.get('actionable_insight'):
-                            st.markdown(f"<div class='actionable'><strong>💡 Try This:</strong> {res['actionable_insight']}</div>", unsafe_allow_html=True)
-                        
-                        # Coping suggestions
-                        if res.get('coping_suggestion') and sentiment < -0.3:
-                            st.markdown(f"<div class='coping-box'><strong>🌿 Grounding Technique:</strong> {res['coping_suggestion']}</div>", unsafe_allow_html=True)
-                        
-                        # Follow-up questions
-                        st.markdown("### 🪞 Reflection Questions")
-                        for i, fup in enumerate(res.get("followups", []), 1):
-                            with st.expander(f"Q{i}: {fup['question']}", expanded=False):
-                                st.write(fup.get('follow_up', ''))
-                        
-                        # Save entry
-                        if "reflection" in res:
-                            insert_entry({
-                                "timestamp": datetime.datetime.now().isoformat(),
-                                "entry": entry,
-                                "reflection": res["reflection"],
-                                "summary": res.get("summary", ""),
-                                "followups": res.get("followups", []),
-                                "tone": res.get("tone", ""),
-                                "safety": res.get("safety_flag", False),
-                                "sentiment": sentiment,
-                                "emotion": emotion
-                            })
-                            st.success("✅ Entry saved!")
+                        res = value
                 
+                if "error" in res:
+                    reflection_box.empty()
+                    st.error(res["error"])
+                else:
+                    reflection_box.markdown(
+                        f"### 💬 {emoji} Reflection\n\n<div class='reflection-output'>\"{res.get('reflection', streamed)}\"</div>",
+                        unsafe_allow_html=True
+                    )
+                    
+                    # Metrics
+                    severity = get_emotion_severity(sentiment)
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Emotion", emotion)
+                    with col2:
+                        st.metric("Sentiment", f"{sentiment:.2f}", delta=None)
+                    with col3:
+                        st.metric("Severity", severity)
+                    
+                    # Summary & Actionable Insight
+                    st.info(f"**Summary:** {res['summary']}")
+                    if res.get('actionable_insight'):
+                        st.markdown(f"<div class='actionable'><strong>💡 Try This:</strong> {res['actionable_insight']}</div>", unsafe_allow_html=True)
+                    
+                    # Coping suggestions
+                    if res.get('coping_suggestion') and sentiment < -0.3:
+                        st.markdown(f"<div class='coping-box'><strong>🌿 Grounding Technique:</strong> {res['coping_suggestion']}</div>", unsafe_allow_html=True)
+                    
+                    # Follow-up questions
+                    st.markdown("### 🪞 Reflection Questions")
+                    for i, fup in enumerate(res.get("followups", []), 1):
+                        with st.expander(f"Q{i}: {fup['question']}", expanded=False):
+                            st.write(fup.get('follow_up', ''))
+                    
+                    # Save entry
+                    if "reflection" in res:
+                        submission.save({
+                            "timestamp": datetime.datetime.now().isoformat(),
+                            "entry": entry,
+                            "reflection": res["reflection"],
+                            "summary": res.get("summary", ""),
+                            "followups": res.get("followups", []),
+                            "tone": res.get("tone", ""),
+                            "safety": res.get("safety_flag", False),
+                            "sentiment": sentiment,
+                            "emotion": emotion
+                        })
+                        st.success("✅ Entry saved!")
+            
                 # Similar entries
                 st.markdown("---")
                 st.markdown("### 🧭 Similar Past Reflections")
-                df_prev = load_entries()
-                similar = get_similar_entries(entry, df_prev, top_n=3)
+                # Looked up in the background while the reflection streamed
+                similar = submission.similar()
                 
                 if isinstance(similar, list) and len(similar) == 0:
                     st.caption("No similar entries yet.")
@@ -280,6 +387,8 @@ with tabs[0]:
                             <small>{sim['entry'][:150]}...</small>
                         </div>
                         """, unsafe_allow_html=True)
+            
+            submission.finish()
 
 # ============================
 # TAB 2: SEARCH & FILTER
@@ -287,12 +396,10 @@ with tabs[0]:
 with tabs[1]:
     st.header("🔍 Search & Filter Your Journal")
     
-    df = load_entries()
-    if df.empty:
+    emotion_options = get_emotion_options()
+    if not emotion_options:
         st.info("No entries yet. Start journaling!")
     else:
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        
         # Filters
         col1, col2, col3 = st.columns(3)
         
@@ -300,39 +407,42 @@ with tabs[1]:
             search_query = st.text_input("🔎 Search entries", placeholder="keyword, phrase...")
         
         with col2:
-            emotion_filter = st.multiselect("Filter by emotion", options=df["emotion"].unique())
+            emotion_filter = st.multiselect("Filter by emotion", options=emotion_options)
         
         with col3:
             sentiment_range = st.slider("Sentiment range", -1.0, 1.0, (-1.0, 1.0))
         
-        # Apply filters
-        filtered = df.copy()
-        
+        # Sort options
+        sort_options = {
+            "Newest First": "newest", "Oldest First": "oldest",
+            "Most Positive": "most_positive", "Most Negative": "most_negative",
+        }
         if search_query:
-            filtered = filtered[filtered["entry"].str.lower().str.contains(search_query.lower(), na=False)]
+            sort_options["Most Relevant"] = "relevance"
+        sort_by = st.radio("Sort by:", list(sort_options), horizontal=True)
         
-        if emotion_filter:
-            filtered = filtered[filtered["emotion"].isin(emotion_filter)]
-        
-        filtered = filtered[(filtered["sentiment"] >= sentiment_range[0]) & (filtered["sentiment"] <= sentiment_range[1])]
+        # Filtering, sorting and paging all happen in SQL; only the current page is loaded
+        page = st.session_state.get("search_page", 1)
+        filtered, total = search_entries(
+            search_query, emotion_filter, sentiment_range, order=sort_options[sort_by],
+            limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE
+        )
         
         # Results
-        st.markdown(f"### 📋 Results ({len(filtered)} entries)")
+        st.markdown(f"### 📋 Results ({total} entries)")
         
-        if len(filtered) == 0:
+        if total == 0:
             st.warning("No entries match your filters.")
         else:
-            # Sort options
-            sort_by = st.radio("Sort by:", ["Newest First", "Oldest First", "Most Positive", "Most Negative"], horizontal=True)
-            
-            if sort_by == "Newest First":
-                filtered = filtered.sort_values("timestamp", ascending=False)
-            elif sort_by == "Oldest First":
-                filtered = filtered.sort_values("timestamp", ascending=True)
-            elif sort_by == "Most Positive":
-                filtered = filtered.sort_values("sentiment", ascending=False)
-            else:
-                filtered = filtered.sort_values("sentiment", ascending=True)
+            n_pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+            if page > n_pages:
+                # Filters changed and the old page no longer exists
+                page = st.session_state["search_page"] = 1
+                filtered, total = search_entries(
+                    search_query, emotion_filter, sentiment_range, order=sort_options[sort_by],
+                    limit=SEARCH_PAGE_SIZE, offset=0
+                )
+            filtered["timestamp"] = pd.to_datetime(filtered["timestamp"], format="ISO8601")
             
             # Display results
             for idx, row in filtered.iterrows():
@@ -349,19 +459,23 @@ with tabs[1]:
                     <em>{row['reflection']}</em>
                 </div>
                 """, unsafe_allow_html=True)
+            
+            if n_pages > 1:
+                st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, key="search_page")
 
 # ============================
 # TAB 3: ANALYTICS
 # ============================
+# Re-read so an entry saved in the Journal tab during this run shows up below
+data_ver = data_version()
+
 with tabs[2]:
     st.header("📊 Your Emotional Journey")
     
-    df = load_entries()
+    df = cached("timeline", load_timeline, data_ver)
     if df.empty:
         st.info("No entries yet — start journaling to see trends!")
     else:
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        df = df.sort_values("timestamp")
         
         # Overview metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -383,23 +497,12 @@ with tabs[2]:
         
         with col1:
             st.subheader("Sentiment Over Time")
-            fig, ax = plt.subplots(figsize=(10, 4), facecolor='#121212')
-            ax.set_facecolor('#1E1E2F')
-            
-            x = df["timestamp"]
-            y = df["sentiment"].values
-            
-            for i in range(len(x) - 1):
-                color = "#22C55E" if y[i] >= 0.5 else "#F59E0B" if y[i] > 0 else "#EF4444"
-                ax.plot(x.iloc[i:i+2], y[i:i+2], color=color, linewidth=3, marker='o')
-            
-            ax.set_ylabel("Sentiment Score", color="#E5E7EB")
-            ax.set_xlabel("Date", color="#E5E7EB")
-            ax.tick_params(colors="#E5E7EB")
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
-            ax.grid(alpha=0.2, color="#E5E7EB")
-            plt.tight_layout()
-            st.pyplot(fig)
+            chart = cached(
+                "sentiment_chart",
+                lambda: render_sentiment_chart(df["timestamp"].to_numpy(), df["sentiment"].to_numpy()),
+                data_ver
+            )
+            st.image(chart, use_container_width=True)
         
         with col2:
             st.subheader("Emotion Distribution")
@@ -415,9 +518,7 @@ with tabs[2]:
         
         # Detailed table
         st.subheader("📋 Recent Entries")
-        display_df = df.tail(10).sort_values("timestamp", ascending=False)[["timestamp", "emotion", "sentiment", "summary"]].copy()
-        display_df["timestamp"] = display_df["timestamp"].dt.strftime("%b %d, %Y")
-        display_df["sentiment"] = display_df["sentiment"].round(2)
+        display_df = cached("recent_table", load_recent_table, data_ver)
         st.dataframe(display_df, use_container_width=True)
 
 # ============================
@@ -426,14 +527,12 @@ with tabs[2]:
 with tabs[3]:
     st.header("💡 Emotional Insights & Patterns")
     
-    df = load_entries()
-    if df.empty:
+    aggregates = cached("aggregates", get_aggregates, data_ver)
+    # Pattern analysis
+    patterns = get_emotion_patterns_from_aggregates(aggregates)
+    if not patterns:
         st.info("Journal more entries to unlock pattern insights!")
     else:
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        
-        # Pattern analysis
-        patterns = get_emotion_patterns(df)
         
         st.subheader("🎯 Emotion Frequency")
         if patterns.get("emotion_frequency"):
@@ -473,17 +572,38 @@ with tabs[3]:
         st.markdown("---")
         
         st.subheader("🔄 Common Emotion Transitions")
-        transitions = get_emotion_triggers(df)
+        transitions = get_emotion_triggers_from_aggregates(aggregates)
         if transitions:
-            for transition, count in transitions.items():
-                st.write(f"**{transition}** — *happened {count} times*")
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                matrix = transition_matrix_from_aggregates(aggregates)
+                fig, ax = plt.subplots(figsize=(7, 6), facecolor='#121212')
+                ax.set_facecolor('#1E1E2F')
+                image = ax.imshow(matrix.values, cmap="Purples")
+                ax.set_xticks(range(len(matrix.columns)))
+                ax.set_xticklabels(matrix.columns, rotation=45, ha='right', color="#E5E7EB")
+                ax.set_yticks(range(len(matrix.index)))
+                ax.set_yticklabels(matrix.index, color="#E5E7EB")
+                ax.set_xlabel("Next emotion", color="#E5E7EB")
+                ax.set_ylabel("Previous emotion", color="#E5E7EB")
+                cbar = fig.colorbar(image, ax=ax)
+                cbar.ax.tick_params(colors="#E5E7EB")
+                plt.tight_layout()
+                st.pyplot(fig)
+            with col2:
+                for transition, count in transitions.items():
+                    st.write(f"**{transition}** — *happened {count} times*")
         else:
             st.info("Not enough entries to detect patterns yet.")
         
         st.markdown("---")
         
         st.subheader("🔍 What Comes Before Low Mood Days?")
-        low_context = get_low_sentiment_context(df)
+        low_context = cached(
+            "low_sentiment_context",
+            lambda: get_low_sentiment_context(load_entries(columns=["entry", "sentiment"], sentiment_below=-0.3)),
+            data_ver
+        )
         if low_context:
             st.write("**Common themes in difficult days:**")
             for word, freq in list(low_context.items())[:10]:
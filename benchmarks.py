@@ -0,0 +1,917 @@
+"""
+Benchmarks and comparison harnesses for ReflectAI.
+
+Usage:
+    python benchmarks.py emotion-backends [--configs pytorch quantized onnx pytorch:valhalla/distilbart-mnli-12-1]
+                                          [--samples samples.jsonl]
+    python benchmarks.py crisis [--words 5000] [--repeat 50]
+    python benchmarks.py similarity [--entries 100000] [--queries 200]
+    python benchmarks.py db-stress [--writers 4] [--readers 8] [--seconds 10]
+    python benchmarks.py load-entries [--rows 50000] [--repeat 5]
+    python benchmarks.py insights [--sizes 10000 100000 1000000]
+    python benchmarks.py chart [--points 500 5000 50000] [--legacy-max 5000]
+    python benchmarks.py providers [--requests 200] [--token-delay 0.0]
+    python benchmarks.py dispatch [--requests 100] [--primary-ms 2000] [--fallback-ms 300]
+    python benchmarks.py prompt-tokens [--ollama-url http://localhost:11434]
+    python benchmarks.py json-extract [--corpus outputs.jsonl] [--chatty-kb 200]
+    python benchmarks.py checks
+
+`checks` runs the regression checks below and exits with status 1 if any of them fails.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+# Small hand-labelled sample used when no --samples file is given
+LABELLED_SAMPLES = [
+    ("I keep checking my phone and my heart is racing about tomorrow's interview.", "anxious"),
+    ("There are too many deadlines and I don't know where to even start.", "overwhelmed"),
+    ("Everyone went out tonight and nobody thought to invite me.", "lonely"),
+    ("I snapped at my friend and I can't stop replaying how awful I was.", "ashamed"),
+    ("It's been a month since grandma passed and the house feels empty.", "grieving"),
+    ("We got engaged today and I couldn't stop smiling!", "joyful"),
+    ("Quiet evening, a good book and tea. Nothing more I need.", "content"),
+    ("The bus was late again and my code still won't compile.", "frustrated"),
+    ("Therapy is starting to help and I think next month will be better.", "hopeful"),
+    ("My manager took credit for my work in front of everyone. I'm furious.", "angry"),
+    ("I don't understand what she meant and I can't figure out what to do.", "confused"),
+    ("I stayed in bed until noon again and couldn't make myself do anything.", "unmotivated"),
+    ("Exams, rent and a sick parent - the pressure is constant.", "stressed"),
+    ("Sat by the lake this morning and felt completely calm.", "peaceful"),
+    ("Went to work, had lunch, came home. A regular Tuesday.", "neutral"),
+    ("What if I fail and everyone finds out? I can't sleep thinking about it.", "anxious"),
+    ("I miss my dog so much since he died last week.", "grieving"),
+    ("Finally finished the marathon, best feeling ever!", "joyful"),
+]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _load_samples(path):
+    if not path:
+        return LABELLED_SAMPLES
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                samples.append((row["text"], row["label"].lower()))
+    return samples
+
+
+def _parse_backend_config(spec):
+    backend, _, model_name = spec.partition(":")
+    return backend, model_name or None
+
+
+def compare_emotion_backends(samples, configs):
+    """
+    Runs every (backend, model_name) config over the labelled samples.
+    The first config is the reference: agreement is measured against its predictions.
+    Returns one result dict per config.
+    """
+    from emotion_analysis import build_emotion_classifier, EMOTION_LABELS, EMOTION_MODEL_NAME
+
+    results = []
+    reference = None
+    for backend, model_name in configs:
+        model_name = model_name or EMOTION_MODEL_NAME
+        start = time.perf_counter()
+        classifier = build_emotion_classifier(backend, model_name)
+        load_seconds = time.perf_counter() - start
+
+        # One untimed call so lazy initialisation doesn't skew the first sample
+        classifier(samples[0][0], EMOTION_LABELS, multi_label=False)
+
+        predictions, latencies = [], []
+        for text, _ in samples:
+            start = time.perf_counter()
+            result = classifier(text, EMOTION_LABELS, multi_label=False)
+            latencies.append(time.perf_counter() - start)
+            predictions.append(result["labels"][0])
+
+        if reference is None:
+            reference = predictions
+        results.append({
+            # The backend that actually loaded: ONNX falls back to PyTorch without optimum
+            "backend": classifier.loaded_backend,
+            "model": model_name,
+            "load_s": load_seconds,
+            "accuracy": statistics.mean(p == label for p, (_, label) in zip(predictions, samples)),
+            "agreement": statistics.mean(p == r for p, r in zip(predictions, reference)),
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+        })
+    return results
+
+
+def _run_emotion_backends(args):
+    samples = _load_samples(args.samples)
+    configs = [_parse_backend_config(spec) for spec in args.configs]
+    results = compare_emotion_backends(samples, configs)
+
+    print(f"\n{len(samples)} samples, reference = {results[0]['backend']}:{results[0]['model']}\n")
+    print(f"{'backend':<10} {'model':<36} {'load s':>7} {'acc':>6} {'agree':>6} {'mean ms':>8} {'p95 ms':>8}")
+    for r in results:
+        print(f"{r['backend']:<10} {r['model']:<36} {r['load_s']:>7.1f} {r['accuracy']:>6.2f} "
+              f"{r['agreement']:>6.2f} {r['mean_ms']:>8.1f} {r['p95_ms']:>8.1f}")
+
+
+def _legacy_crisis_detect(text):
+    """The original per-keyword substring scan, kept as a baseline."""
+    from utils import CRISIS_KEYWORDS
+
+    text_lower = text.lower()
+    for keyword in CRISIS_KEYWORDS["self_harm"] + CRISIS_KEYWORDS["suicidal"]:
+        if keyword in text_lower:
+            return "critical"
+    for keyword in CRISIS_KEYWORDS["hopelessness"] + CRISIS_KEYWORDS["acute_distress"]:
+        if keyword in text_lower:
+            return "high"
+    for keyword in CRISIS_KEYWORDS["substance_abuse"]:
+        if keyword in text_lower:
+            return "moderate"
+    return None
+
+
+def _time_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+# Entries with the severity crisis_detect must report: inflected keywords must still be
+# caught and everyday phrases that contain a keyword must not be
+CRISIS_CASES = [
+    ("I started bleeding again", "critical"),
+    ("I overdosed last year", "critical"),
+    ("thinking about self harming", "critical"),
+    ("I keep cutting myself", "critical"),
+    ("I want to slice my wrists", "critical"),
+    ("I could slice myself open", "critical"),
+    ("I thought about how to slit my wrists", "critical"),
+    ("I feel hopelessness every morning", "high"),
+    ("I can\u2019t take it anymore", "high"),
+    ("I just want to give up", "high"),
+    ("everything's pointless lately", "high"),
+    ('she said "Suicide" in class', "critical"),
+    ("I could slit my-wrists tonight", "critical"),
+    # Separators inside a keyword must match exactly, not just any separator
+    ("Everything s pointless", None),
+    ("I want to kill-myself", None),
+    ("Had a slice of pizza with friends", None),
+    ("The weekend items are packed", None),
+    ("I finished the book and the ending was sweet", None),
+]
+
+
+def check_crisis_cases():
+    """Returns [(text, expected, got), ...] for the CRISIS_CASES crisis_detect gets wrong."""
+    from utils import crisis_detect
+
+    return [(text, expected, got) for text, expected in CRISIS_CASES if (got := crisis_detect(text)) != expected]
+
+
+def _run_crisis(args):
+    import random
+    from utils import crisis_scan
+
+    failures = check_crisis_cases()
+    print(f"\nSeverity cases: {len(CRISIS_CASES) - len(failures)}/{len(CRISIS_CASES)} correct")
+    for text, expected, got in failures:
+        print(f"  {text!r}: expected {expected}, got {got}")
+
+    rng = random.Random(0)
+    filler = ("today work was long and I went for a walk after dinner with friends "
+              "then watched a movie and thought about the week ahead").split()
+    clean = " ".join(rng.choice(filler) for _ in range(args.words))
+    # Worst case for the legacy scan: the only keyword is at the very end
+    late_hit = clean + " and honestly I feel like I am losing it"
+    early_hit = "I want to give up. " + clean
+    punctuated = ". ".join(", ".join(clean.split(" ")[i:i + 6]) for i in range(0, args.words, 6))
+
+    print(f"\nEntry length: {args.words} words, {args.repeat} runs each\n")
+    print(f"{'case':<12} {'legacy ms':>10} {'scan ms':>10} {'scan (substr) ms':>17}")
+    for name, text in [("no match", clean), ("punctuated", punctuated), ("early match", early_hit),
+                       ("late match", late_hit)]:
+        legacy = _time_call(lambda: _legacy_crisis_detect(text), args.repeat)
+        scan = _time_call(lambda: crisis_scan(text), args.repeat)
+        loose = _time_call(lambda: crisis_scan(text, word_boundary=False), args.repeat)
+        print(f"{name:<12} {legacy * 1000:>10.3f} {scan * 1000:>10.3f} {loose * 1000:>17.3f}")
+
+
+def _synthetic_journal(n_entries, seed=0, vocab_size=8000, n_topics=60, words_per_entry=60):
+    """Topic-mixture text so that entries have real near neighbours, unlike uniform noise."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"w{i}" for i in range(vocab_size)])
+    topics = rng.dirichlet(np.full(vocab_size, 0.02), size=n_topics)
+    texts = []
+    for _ in range(n_entries):
+        mix = rng.dirichlet(np.full(n_topics, 0.1))
+        word_probs = mix @ topics
+        texts.append(" ".join(rng.choice(vocab, size=words_per_entry, p=word_probs)))
+    return texts
+
+
+def _run_similarity(args):
+    import os
+    import tempfile
+    import numpy as np
+    from similarity_index import SimilarityIndex
+
+    print(f"\nGenerating {args.entries} entries + {args.queries} queries...")
+    texts = _synthetic_journal(args.entries + args.queries)
+    corpus, queries = texts[:args.entries], texts[args.entries:]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SimilarityIndex(path=os.path.join(tmp, "bench.similarity.pkl"))
+        start = time.perf_counter()
+        index.fit(list(range(1, len(corpus) + 1)), corpus, catch_up=False)
+        print(f"Fitted TF-IDF index in {time.perf_counter() - start:.1f}s")
+        vectorizer, matrix, ids = index.snapshot()
+
+        def brute_force(q):
+            # Row-major matrix-vector product over every entry, as before the index existed
+            scores = (matrix @ vectorizer.transform([q]).T).toarray().ravel()
+            return {int(ids[i]) for i in np.argsort(-scores, kind="stable")[:3]}
+
+        def timed(fn):
+            results, times = [], []
+            for q in queries:
+                start = time.perf_counter()
+                results.append(fn(q))
+                times.append(time.perf_counter() - start)
+            return results, times
+
+        def row(label, times, results):
+            hits = sum(len(found & expected) for found, expected in zip(results, truth))
+            print(f"{label:<18} {statistics.mean(times) * 1000:>8.2f} "
+                  f"{_percentile(times, 95) * 1000:>8.2f} {hits / (3 * len(queries)):>9.3f}")
+
+        index.query(queries[0])  # builds the inverted (CSC) copy
+        truth, brute_times = timed(brute_force)
+        exact, exact_times = timed(lambda q: {r for r, _ in index.query(q, top_n=3)})
+
+        print(f"\n{'mode':<18} {'mean ms':>8} {'p95 ms':>8} {'recall@3':>9}")
+        row("brute force (CSR)", brute_times, truth)
+        row("exact (inverted)", exact_times, exact)
+
+
+def _run_db_stress(args):
+    import os
+    import sqlite3
+    import tempfile
+    import threading
+    import database
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "stress.db")
+        database.init_db()
+        texts = _synthetic_journal(200, words_per_entry=40)
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        stats = {"write": [], "read": [], "search": []}
+        errors = []
+
+        def record(kind, fn):
+            start = time.perf_counter()
+            try:
+                fn()
+            except sqlite3.Error as e:
+                with lock:
+                    errors.append(f"{kind}: {e}")
+                return
+            elapsed = time.perf_counter() - start
+            with lock:
+                stats[kind].append(elapsed)
+
+        def writer(n):
+            i = 0
+            while not stop.is_set():
+                text = texts[(n * 31 + i) % len(texts)]
+                record("write", lambda: database.insert_entry({
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "entry": text,
+                    "reflection": "", "summary": "", "followups": [], "tone": "", "safety": "safe",
+                    "sentiment": 0.0, "emotion": "neutral",
+                }))
+                i += 1
+
+        def reader(n):
+            i = 0
+            while not stop.is_set():
+                if i % 2:
+                    record("read", lambda: database.search_entries(limit=20))
+                else:
+                    record("search", lambda: database.search_entries(texts[(n + i) % len(texts)].split()[0], limit=20))
+                i += 1
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+        threads += [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        with database.get_pool().connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM journals").fetchone()[0]
+        database.close_pools()
+
+    print(f"\n{args.writers} writers, {args.readers} readers, {args.seconds}s; {rows} rows written\n")
+    print(f"{'op':<8} {'count':>7} {'ops/s':>8} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for kind, times in stats.items():
+        if times:
+            print(f"{kind:<8} {len(times):>7} {len(times) / args.seconds:>8.0f} {statistics.mean(times) * 1000:>8.2f} "
+                  f"{_percentile(times, 95) * 1000:>8.2f} {max(times) * 1000:>8.2f}")
+    print(f"\nErrors: {len(errors)}")
+    for error in sorted(set(errors))[:5]:
+        print(f"  {error}")
+
+
+def _fill_journal(n_rows, seed=0):
+    """Inserts n_rows synthetic entries (with reflection text) into the current database.DB_FILE."""
+    import datetime
+    import json
+    import random
+    import database
+
+    rng = random.Random(seed)
+    texts = _synthetic_journal(500, seed=seed, words_per_entry=120)
+    emotions = ["anxious", "content", "frustrated", "hopeful", "lonely", "neutral", "stressed"]
+    start = datetime.datetime(2022, 1, 1)
+    rows = []
+    for i in range(n_rows):
+        when = start + datetime.timedelta(minutes=37 * i)
+        rows.append((
+            when.isoformat(), database.to_epoch(when), texts[i % len(texts)], texts[(i * 7) % len(texts)],
+            "summary of the day", json.dumps(["How did that feel?", "What helped?"]), "warm", "safe",
+            round(rng.uniform(-1, 1), 3), rng.choice(emotions),
+        ))
+    with database.get_pool().transaction() as conn:
+        conn.executemany("""
+            INSERT INTO journals (timestamp, created_at, entry, reflection, summary, followups, tone, safety, sentiment, emotion)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+
+def _run_load_entries(args):
+    import os
+    import tempfile
+    import tracemalloc
+    import database
+
+    def full_rerun():
+        # What every rerun used to read: SELECT * for the sidebar, Analytics and Insights
+        return [database.load_entries() for _ in range(3)]
+
+    def projected_rerun():
+        return [
+            database.load_entries(columns=["emotion", "sentiment"]),
+            database.load_entries(columns=["entry", "emotion"], limit=1),
+            database.load_entries(columns=["timestamp", "sentiment", "emotion"], ascending=True),
+            database.load_entries(columns=["timestamp", "emotion", "sentiment", "summary"], limit=10),
+            database.load_entries(columns=["timestamp", "sentiment", "emotion"]),
+            database.load_entries(columns=["entry", "sentiment"], sentiment_below=-0.3),
+        ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "load.db")
+        database.init_db()
+        _fill_journal(args.rows)
+        print(f"\n{args.rows} rows, DB size {os.path.getsize(database.DB_FILE) / 2**20:.0f} MB, {args.repeat} reruns each\n")
+        print(f"{'rerun':<10} {'mean ms':>8} {'frames MB':>10} {'peak alloc MB':>14}")
+        for label, rerun in [("SELECT *", full_rerun), ("projected", projected_rerun)]:
+            rerun()  # warm the page cache
+            times = [_time_call(rerun, 1) for _ in range(args.repeat)]
+            tracemalloc.start()
+            frames = rerun()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            frames_mb = sum(f.memory_usage(deep=True).sum() for f in frames) / 2**20
+            print(f"{label:<10} {statistics.mean(times) * 1000:>8.1f} {frames_mb:>10.1f} {peak / 2**20:>14.1f}")
+        database.close_pools()
+
+
+def _legacy_emotion_triggers(df):
+    """The original string-building transition count, kept as a baseline."""
+    from collections import Counter
+
+    df_sorted = df.sort_values("timestamp").reset_index(drop=True)
+    emotions = df_sorted["emotion"].tolist()
+    transitions = []
+    for i in range(len(emotions) - 1):
+        transitions.append(f"{emotions[i]} → {emotions[i+1]}")
+    return dict(Counter(transitions).most_common(5))
+
+
+def _legacy_low_sentiment_context(df, threshold=-0.3):
+    """The original join-then-split word count, kept as a baseline."""
+    from collections import Counter
+
+    all_text = " ".join(df[df["sentiment"] < threshold]["entry"].tolist())
+    stop_words = {"the", "a", "an", "and", "or", "but", "in", "on", "at", "to", "for", "is", "are", "was", "were"}
+    words = [w for w in all_text.lower().split() if w not in stop_words and len(w) > 3]
+    return dict(Counter(words).most_common(10))
+
+
+def _synthetic_frame(n_rows, seed=0, words_per_entry=30):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    emotions = np.array(["anxious", "content", "frustrated", "hopeful", "lonely", "neutral", "stressed", "joyful"])
+    vocab = np.array([f"word{i}" for i in range(5000)] + ["the", "and", "was", "today", "really"])
+    # Entries are sampled from a fixed pool so generating 1M rows stays cheap
+    pool = [" ".join(rng.choice(vocab, size=words_per_entry)) for _ in range(2000)]
+    return pd.DataFrame({
+        "timestamp": pd.date_range("2000-01-01", periods=n_rows, freq="37min"),
+        "emotion": rng.choice(emotions, size=n_rows),
+        "sentiment": rng.uniform(-1, 1, size=n_rows).round(3),
+        "entry": [pool[i] for i in rng.integers(0, len(pool), size=n_rows)],
+    })
+
+
+def _run_insights(args):
+    import tracemalloc
+    from utils import get_emotion_triggers, get_low_sentiment_context
+
+    cases = [
+        ("triggers", _legacy_emotion_triggers, get_emotion_triggers),
+        ("low-mood words", _legacy_low_sentiment_context, get_low_sentiment_context),
+    ]
+    print(f"\n{'rows':>9} {'function':<15} {'legacy ms':>10} {'new ms':>9} {'legacy MB':>10} {'new MB':>8} {'same top':>9}")
+    for n_rows in args.sizes:
+        df = _synthetic_frame(n_rows)
+        for name, legacy, new in cases:
+            row = []
+            for fn in (legacy, new):
+                start = time.perf_counter()
+                result = fn(df)
+                elapsed = time.perf_counter() - start
+                # Measured in a second run: tracing allocations slows Python loops down a lot
+                tracemalloc.start()
+                fn(df)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                row.append((elapsed, peak, result))
+            (old_s, old_peak, old_result), (new_s, new_peak, new_result) = row
+            # The new word count uses a larger stop-word list, so only the transitions should match exactly
+            same = list(old_result.values()) == list(new_result.values())
+            print(f"{n_rows:>9} {name:<15} {old_s * 1000:>10.1f} {new_s * 1000:>9.1f} "
+                  f"{old_peak / 2**20:>10.1f} {new_peak / 2**20:>8.1f} {str(same):>9}")
+
+
+def _legacy_sentiment_chart(timestamps, sentiments):
+    """The original one-ax.plot-per-segment chart, rendered to PNG, kept as a baseline."""
+    import io
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    fig, ax = plt.subplots(figsize=(10, 4), facecolor='#121212')
+    ax.set_facecolor('#1E1E2F')
+    x = pd.Series(timestamps)
+    y = sentiments
+    for i in range(len(x) - 1):
+        color = "#22C55E" if y[i] >= 0.5 else "#F59E0B" if y[i] > 0 else "#EF4444"
+        ax.plot(x.iloc[i:i+2], y[i:i+2], color=color, linewidth=3, marker='o')
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
+    ax.grid(alpha=0.2, color="#E5E7EB")
+    plt.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def _run_chart(args):
+    from charts import render_sentiment_chart
+
+    print(f"\n{'points':>8} {'legacy ms':>10} {'new ms':>8}")
+    for n_points in args.points:
+        df = _synthetic_frame(n_points)
+        timestamps, sentiments = df["timestamp"].to_numpy(), df["sentiment"].to_numpy()
+        new = _time_call(lambda: render_sentiment_chart(timestamps, sentiments), 3)
+        if n_points <= args.legacy_max:
+            legacy = f"{_time_call(lambda: _legacy_sentiment_chart(timestamps, sentiments), 1) * 1000:>10.0f}"
+        else:
+            legacy = f"{'skipped':>10}"
+        print(f"{n_points:>8} {legacy} {new * 1000:>8.0f}")
+
+
+def _run_providers(args):
+    import ai_engine
+    from ai_engine import FakeProvider, OllamaProvider, provider_stats, set_providers
+    from ollama_stub import start_stub_server
+
+    server = start_stub_server(token_delay=args.token_delay)
+    prompt = ai_engine.build_contextual_prompt("Long day, but I finished the report.", "tired", 0.1)
+    try:
+        # A fresh provider per request pays for a new client and TCP connection every time
+        fresh = [_time_call(lambda: OllamaProvider(url=server.url).generate(prompt), 1)
+                 for _ in range(args.requests)]
+        shared_provider = OllamaProvider(url=server.url)
+        shared = [_time_call(lambda: shared_provider.generate(prompt), 1) for _ in range(args.requests)]
+        connections = json.loads(shared_provider._get_session().get(f"{server.url}/stub/stats").text)["connections"]
+
+        # Whole reflection path through the provider chain, offline
+        set_providers([FakeProvider(name="fake-down", fail=True), FakeProvider(name="fake")])
+        for _ in range(args.requests):
+            ai_engine.generate_reflection("Long day, but I finished the report.", "tired", 0.1)
+            list(ai_engine.stream_reflection("Long day, but I finished the report.", "tired", 0.1))
+    finally:
+        set_providers(None)
+        server.shutdown()
+        server.server_close()
+
+    print(f"\n{'ollama client':<15} {'mean ms':>8} {'p95 ms':>8}")
+    for label, times in (("per request", fresh), ("shared", shared)):
+        print(f"{label:<15} {statistics.mean(times) * 1000:>8.2f} {_percentile(times, 95) * 1000:>8.2f}")
+    print(f"TCP connections accepted by the stub: {connections}")
+    print(f"\n{'provider':<10} {'requests':>8} {'errors':>7} {'mean ms':>8} {'p95 ms':>8} {'first ms':>9}")
+    for name, info in provider_stats().items():
+        print(f"{name:<10} {info['requests']:>8} {info['errors']:>7} {info['mean_ms'] or 0:>8} "
+              f"{info['p95_ms'] or 0:>8} {info['first_chunk_mean_ms'] or 0:>9}")
+
+
+def _run_dispatch(args):
+    import ai_engine
+    from ai_engine import FakeProvider, reset_provider_stats, set_providers
+
+    primary_s, fallback_s = args.primary_ms / 1000, args.fallback_ms / 1000
+    # The primary answers in primary_ms / 10, except one request in 25 that takes primary_ms
+    # ("slow", a latency tail below its p95), or it fails after primary_ms every time ("dead")
+    scenarios = {
+        "healthy": lambda i: FakeProvider(name="primary", latency=primary_s / 10),
+        "slow": lambda i: FakeProvider(name="primary", latency=primary_s if i % 25 == 24 else primary_s / 10),
+        "dead": lambda i: FakeProvider(name="primary", latency=primary_s, fail=True),
+    }
+
+    print(f"\n{'primary':<9} {'policy':<11} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8} {'fallbacks':>9}")
+    try:
+        for scenario, make_primary in scenarios.items():
+            for policy in ai_engine.DISPATCH_POLICIES:
+                reset_provider_stats()
+                times, fallbacks = [], 0
+                for i in range(args.requests):
+                    fallback = FakeProvider(name="fallback", latency=fallback_s)
+                    set_providers([make_primary(i), fallback])
+                    start = time.perf_counter()
+                    result = list(ai_engine._dispatch("benchmark prompt", policy, stream=False))[-1][1]
+                    times.append(time.perf_counter() - start)
+                    assert "error" not in result, result
+                    fallbacks += fallback.calls
+                print(f"{scenario:<9} {policy:<11} {statistics.mean(times) * 1000:>8.0f} "
+                      f"{_percentile(times, 95) * 1000:>8.0f} {max(times) * 1000:>8.0f} {fallbacks:>9}")
+    finally:
+        set_providers(None)
+        reset_provider_stats()
+
+
+def _legacy_contextual_prompt(user_input, emotion, sentiment):
+    """The original single-string prompt: instructions, schema and a worked example on every request."""
+    if sentiment < -0.7:
+        tone_instruction = "Use an extra compassionate, grounding tone. Focus on safety and immediate coping."
+    elif sentiment < -0.3:
+        tone_instruction = "Use a warm, validating tone. Help them see small positive steps they can take."
+    elif sentiment < 0.3:
+        tone_instruction = "Use a balanced, curious tone. Help them explore what they're experiencing."
+    else:
+        tone_instruction = "Use an encouraging, reinforcing tone. Help them build on this positive momentum."
+
+    followup_context = ""
+    if emotion.lower() == "lonely":
+        followup_context = "Focus follow-ups on connection: relationships, reaching out, community."
+    elif emotion.lower() == "anxious" or emotion.lower() == "overwhelmed":
+        followup_context = "Focus follow-ups on breaking things down into manageable steps and grounding techniques."
+    elif emotion.lower() == "ashamed" or emotion.lower() == "grieving":
+        followup_context = "Focus follow-ups on self-compassion and processing feelings."
+    elif emotion.lower() == "joyful" or emotion.lower() == "hopeful":
+        followup_context = "Focus follow-ups on sustaining this momentum and understanding what contributed."
+    elif emotion.lower() == "frustrated" or emotion.lower() == "angry":
+        followup_context = "Focus follow-ups on understanding the source and healthy expression."
+
+    return f"""
+You are a compassionate, non-judgmental emotional support companion. Your role is to help users reflect deeply on their emotions and find actionable insights.
+
+{tone_instruction}
+
+User's emotional state: {emotion} (sentiment score: {sentiment:.2f})
+{followup_context}
+
+User's journal entry:
+\"\"\"{user_input}\"\"\"
+
+Generate a helpful response with this exact JSON format (no extra text):
+
+{{
+  "reflection": "A 3-4 sentence empathetic reflection that validates their feelings , shows you understand and also do join them in their emotions . If sentiment is very low, include a grounding element.",
+  "summary": "One-line summary capturing the core emotion/theme.",
+  "actionable_insight": "A brief, practical suggestion they could try (not therapy advice, just small actionable steps which could improve or refresh their mind and fresehn them up').",
+  "followups": [
+    {{
+      "question": "A deeply thoughtful follow-up question tailored to their specific situation and emotion",
+      "follow_up": "Why this question matters for their emotional growth"
+    }},
+    {{
+      "question": "A second follow-up that explores either what led to this or what could help them move forward",
+      "follow_up": "The psychological principle or insight behind this question"
+    }}
+  ],
+  "tone": "Description of the tone used (e.g., warm and grounding, gently challenging, celebratory)",
+  "safety_flag": true/false,
+  "coping_suggestion": "If sentiment < -0.3: suggest a grounding or coping technique "
+}}
+
+Example for anxious entry:
+{{
+  "reflection": "It sounds like you're caught in a cycle of worry and uncertainty. That's a completely understandable response to feeling out of control.",
+  "summary": "Overwhelmed by things beyond your control",
+  "actionable_insight": "Try identifying just one thing you CAN control today and focus on that for 10 minutes",
+  "followups": [
+    {{
+      "question": "What's one small thing that's actually within your control right now?",
+      "follow_up": "Helps shift focus from overwhelming unknowns to what you can influence"
+    }},
+    {{
+      "question": "When did this feeling start, and was there a specific trigger?",
+      "follow_up": "Understanding the origin helps address the root cause vs. just the symptoms"
+    }}
+  ],
+  "tone": "calm and grounding, gently refocusing",
+  "safety_flag": false,
+  "coping_suggestion": "Try the 5-4-3-2-1 grounding technique: name 5 things you see, 4 you hear, 3 you touch, 2 you smell, 1 you taste"
+}}
+"""
+
+
+def _first_chunk_seconds(provider, prompt):
+    start = time.perf_counter()
+    chunks = provider.stream(prompt)
+    try:
+        next(chunks)
+        return time.perf_counter() - start
+    finally:
+        chunks.close()
+
+
+def _run_prompt_tokens(args):
+    from ai_engine import OllamaProvider, build_contextual_prompt, estimate_tokens, prompt_band, prompt_tokens
+
+    sentiments = [-0.8, -0.5, 0.0, 0.6]
+    provider = OllamaProvider(url=args.ollama_url) if args.ollama_url else None
+    ttft = f" {'legacy ttft':>11} {'new ttft':>9}" if provider else ""
+    print(f"\n{'emotion':<12} {'band':<14} {'legacy':>7} {'system':>7} {'user':>5} {'saved':>6}{ttft}")
+    totals = [0, 0]
+    for i, (text, emotion) in enumerate(LABELLED_SAMPLES):
+        sentiment = sentiments[i % len(sentiments)]
+        legacy_prompt = _legacy_contextual_prompt(text, emotion.capitalize(), sentiment)
+        prompt = build_contextual_prompt(text, emotion.capitalize(), sentiment)
+        legacy, tokens = estimate_tokens(legacy_prompt), prompt_tokens(prompt)
+        totals[0] += legacy
+        totals[1] += tokens["user"]
+        row = (f"{emotion:<12} {prompt_band(sentiment):<14} {legacy:>7} {tokens['system']:>7} "
+               f"{tokens['user']:>5} {1 - tokens['user'] / legacy:>6.0%}")
+        if provider:
+            row += (f" {_first_chunk_seconds(provider, legacy_prompt) * 1000:>9.0f}ms"
+                    f" {_first_chunk_seconds(provider, prompt) * 1000:>7.0f}ms")
+        print(row)
+    print(f"\nPer-request tokens outside the cached system prompt: {totals[0] / len(LABELLED_SAMPLES):.0f} -> "
+          f"{totals[1] / len(LABELLED_SAMPLES):.0f} on average (approximate counts)")
+
+
+def _legacy_parse_reflection(text):
+    """The original greedy first-"{"-to-last-"}" regex followed by json.loads."""
+    import re
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not match:
+        raise json.JSONDecodeError("No JSON found", text, 0)
+    return json.loads(match.group(0))
+
+
+def _model_output_corpus():
+    """
+    Outputs in the shapes local models produce, built from a valid reflection: clean JSON,
+    JSON wrapped in prose or code fences, prose with braces after the JSON, trailing commas,
+    curly quotes, raw newlines in strings, an echoed example before the answer, and
+    truncated or field-less responses that no parser should accept.
+    """
+    from ai_engine import FAKE_REFLECTION
+
+    clean = json.dumps(FAKE_REFLECTION, indent=2)
+    compact = json.dumps(FAKE_REFLECTION)
+    trailing = clean.replace('"\n}', '",\n}').replace("}\n  ]", "},\n  ]")
+    # Every delimiting quote curly, alternating open and close
+    parts = compact.split('"')
+    curly = parts[0] + "".join(("\u201c" if i % 2 else "\u201d") + part for i, part in enumerate(parts[1:], 1))
+    return [
+        ("clean", clean),
+        ("compact", compact),
+        ("code fence", f"```json\n{clean}\n```"),
+        ("prose before", f"Of course. Here is a reflection for this entry:\n\n{clean}"),
+        ("prose after with braces", f"{clean}\n\nNote: I kept the {{tone}} gentle as requested {{see above}}."),
+        ("trailing commas", trailing),
+        ("curly quotes", curly),
+        ("raw newline", compact.replace("on your mind. ", "on your mind.\n")),
+        ("raw tab", compact.replace("on your mind. ", "on your mind.\t")),
+        ("stray brace before", f"I use {{ a lot when I write. {compact}"),
+        ("example echoed first", f'Example: {{"reflection": "...", "summary": "..."}}\nAnswer: {compact}'),
+        ("string follow-ups", json.dumps({**FAKE_REFLECTION, "followups": ["What helped today?"]})),
+        ("truncated", clean[:len(clean) // 2]),
+        ("missing fields", json.dumps({"tone": "warm"})),
+        ("no json", "I'm sorry, I can't help with that request."),
+    ]
+
+
+def check_json_extract():
+    """Recoverable outputs must parse, and a large never-closing output must fail in linear time."""
+    from ai_engine import parse_reflection
+
+    failures = []
+    for text in ['I use { a lot. {"reflection": "x", "summary": "y"}', '{"reflection": "a\tb\rc", "summary": "y"}']:
+        try:
+            parse_reflection(text)
+        except ValueError as e:
+            failures.append(f"{text!r}: {e}")
+    # A looping model that opens objects and never closes them; a rescan per "{" takes minutes here
+    looping = '{"k": [' * 20_000
+    start = time.perf_counter()
+    try:
+        parse_reflection(looping)
+    except ValueError:
+        pass
+    elapsed = time.perf_counter() - start
+    if elapsed > 1.0:
+        failures.append(f"{len(looping) // 1024} KB unclosed output took {elapsed:.1f} s")
+    return failures
+
+
+def check_search_punctuation():
+    """A keyword query made only of punctuation must filter entries, not match all of them."""
+    import os
+    import tempfile
+    import database
+
+    db_file = database.DB_FILE
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "search.db")
+        try:
+            database.init_db()
+            for i, entry in enumerate(["what a day!!!", "quiet evening", "tired -- but okay"]):
+                database.insert_entry({
+                    "timestamp": f"2024-01-0{i + 1} 20:00:00", "entry": entry, "reflection": "", "summary": "",
+                    "followups": [], "tone": "", "safety": False, "sentiment": 0.0, "emotion": "neutral",
+                })
+            for query, expected in [("!!!", ["what a day!!!"]), ("--", ["tired -- but okay"]), ("?", []),
+                                    ("evening", ["quiet evening"])]:
+                df, total = database.search_entries(query)
+                if sorted(df["entry"]) != expected or total != len(expected):
+                    failures.append(f"{query!r}: expected {expected}, got {sorted(df['entry'])} (total {total})")
+        finally:
+            database.close_pools()
+            database.DB_FILE = db_file
+    return failures
+
+
+def _run_json_extract(args):
+    from ai_engine import parse_reflection, validate_reflection
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [(f"record {i + 1}", json.loads(line)["output"]) for i, line in enumerate(f) if line.strip()]
+    else:
+        corpus = _model_output_corpus()
+
+    def usable(parse, text):
+        try:
+            data = parse(text)
+        except ValueError:
+            return False
+        return isinstance(data, dict) and not validate_reflection(dict(data))
+
+    print(f"\n{'output':<26} {'legacy':>7} {'new':>5}")
+    legacy_ok = new_ok = 0
+    for name, text in corpus:
+        old, new = usable(_legacy_parse_reflection, text), usable(parse_reflection, text)
+        legacy_ok += old
+        new_ok += new
+        print(f"{name:<26} {str(old):>7} {str(new):>5}")
+    print(f"\nUsable: legacy {legacy_ok}/{len(corpus)}, new {new_ok}/{len(corpus)} -> "
+          f"{new_ok - legacy_ok} fewer fallbacks to the next provider")
+
+    # A long, chatty output with many unclosed braces: the greedy regex retries from every "{"
+    chatty = "Thinking about {the entry and {what to say... " * (args.chatty_kb * 1024 // 47)
+    legacy_s = _time_call(lambda: usable(_legacy_parse_reflection, chatty), 1)
+    new_s = _time_call(lambda: usable(parse_reflection, chatty), 1)
+    print(f"{args.chatty_kb} KB chatty output without JSON: legacy {legacy_s * 1000:.1f} ms, new {new_s * 1000:.1f} ms")
+
+
+# name -> function returning a list of failure descriptions (empty when the check passes)
+REGRESSION_CHECKS = {
+    "crisis severity": lambda: [f"{text!r}: expected {expected}, got {got}" for text, expected, got in check_crisis_cases()],
+    "json extraction": check_json_extract,
+    "punctuation-only search": check_search_punctuation,
+}
+
+
+def _run_checks(args):
+    failed = 0
+    for name, check in REGRESSION_CHECKS.items():
+        failures = check()
+        failed += bool(failures)
+        print(f"{'FAIL' if failures else 'ok':<5} {name}")
+        for failure in failures:
+            print(f"      {failure}")
+    if failed:
+        print(f"\n{failed} of {len(REGRESSION_CHECKS)} checks failed")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ReflectAI benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    emotion = subparsers.add_parser("emotion-backends", help="Accuracy vs latency of emotion classifier backends")
+    emotion.add_argument("--configs", nargs="+", default=["pytorch", "quantized", "onnx"],
+                         help="backend[:model] specs; the first one is the reference")
+    emotion.add_argument("--samples", help="JSONL file with {\"text\": ..., \"label\": ...} rows")
+    emotion.set_defaults(func=_run_emotion_backends)
+
+    crisis = subparsers.add_parser("crisis", help="Crisis keyword scan on long entries")
+    crisis.add_argument("--words", type=int, default=5000)
+    crisis.add_argument("--repeat", type=int, default=50)
+    crisis.set_defaults(func=_run_crisis)
+
+    similarity = subparsers.add_parser("similarity", help="Inverted-index vs brute-force similar-entry search")
+    similarity.add_argument("--entries", type=int, default=100_000)
+    similarity.add_argument("--queries", type=int, default=200)
+    similarity.set_defaults(func=_run_similarity)
+
+    stress = subparsers.add_parser("db-stress", help="Concurrent writers and readers against one SQLite file")
+    stress.add_argument("--writers", type=int, default=4)
+    stress.add_argument("--readers", type=int, default=8)
+    stress.add_argument("--seconds", type=float, default=10)
+    stress.set_defaults(func=_run_db_stress)
+
+    load = subparsers.add_parser("load-entries", help="Time and memory of one app rerun's entry loading")
+    load.add_argument("--rows", type=int, default=50_000)
+    load.add_argument("--repeat", type=int, default=5)
+    load.set_defaults(func=_run_load_entries)
+
+    insights = subparsers.add_parser("insights", help="Emotion transitions and low-mood word counts on large journals")
+    insights.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+    insights.set_defaults(func=_run_insights)
+
+    chart = subparsers.add_parser("chart", help="Render time of the Sentiment Over Time chart")
+    chart.add_argument("--points", nargs="+", type=int, default=[500, 5000, 50000])
+    chart.add_argument("--legacy-max", type=int, default=5000,
+                       help="skip the per-segment baseline above this many points (it takes minutes)")
+    chart.set_defaults(func=_run_chart)
+
+    providers = subparsers.add_parser("providers", help="Reflection provider request overhead against the Ollama stub")
+    providers.add_argument("--requests", type=int, default=200)
+    providers.add_argument("--token-delay", type=float, default=0.0,
+                           help="stub pause before each streamed chunk")
+    providers.set_defaults(func=_run_providers)
+
+    dispatch = subparsers.add_parser("dispatch", help="Reflection latency per dispatch policy with a slow or dead primary")
+    dispatch.add_argument("--requests", type=int, default=100)
+    dispatch.add_argument("--primary-ms", type=float, default=2000,
+                          help="primary provider latency when slow, and its time to fail when dead")
+    dispatch.add_argument("--fallback-ms", type=float, default=300)
+    dispatch.set_defaults(func=_run_dispatch)
+
+    tokens = subparsers.add_parser("prompt-tokens", help="Prompt size per request, legacy vs system-prefix templates")
+    tokens.add_argument("--ollama-url", help="also time the first streamed chunk against this Ollama server")
+    tokens.set_defaults(func=_run_prompt_tokens)
+
+    extract = subparsers.add_parser("json-extract", help="Reflection JSON parsing success and speed on model outputs")
+    extract.add_argument("--corpus", help="JSONL file of recorded outputs, one {\"output\": ...} per line")
+    extract.add_argument("--chatty-kb", type=int, default=200)
+    extract.set_defaults(func=_run_json_extract)
+
+    checks = subparsers.add_parser("checks", help="Regression checks; exits with status 1 on failure")
+    checks.set_defaults(func=_run_checks)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
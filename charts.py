@@ -0,0 +1,93 @@
+import io
+
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+# Dashboard palette
+BACKGROUND = "#121212"
+PANEL = "#1E1E2F"
+TEXT = "#E5E7EB"
+POSITIVE = "#22C55E"
+MILD = "#F59E0B"
+NEGATIVE = "#EF4444"
+
+
+def sentiment_colors(values):
+    """Green for sentiment >= 0.5, amber above 0, red otherwise."""
+    values = np.asarray(values)
+    return np.where(values >= 0.5, POSITIVE, np.where(values > 0, MILD, NEGATIVE))
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of at most `threshold`
+    points that keep the visual shape of the series (peaks and dips survive, unlike with
+    plain striding). x must be increasing.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # First and last points are always kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def render_sentiment_chart(timestamps, sentiments, width_px=1000, height_px=400, dpi=100):
+    """
+    Draws the "Sentiment Over Time" chart and returns it as PNG bytes.
+
+    Segments are coloured by the sentiment at their start and drawn as one LineCollection with
+    one scatter for the markers, so the cost doesn't grow with the number of artists. Series
+    longer than the chart is wide are reduced with LTTB to one point per horizontal pixel.
+    """
+    x = mdates.date2num(np.asarray(timestamps, dtype="datetime64[ns]"))
+    y = np.asarray(sentiments, dtype=float)
+    if len(x) > width_px:
+        keep = lttb(x, y, width_px)
+        x, y = x[keep], y[keep]
+
+    fig = Figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi, facecolor=BACKGROUND)
+    ax = fig.add_subplot()
+    ax.set_facecolor(PANEL)
+
+    colors = sentiment_colors(y)
+    if len(x) > 1:
+        segments = np.stack([np.column_stack([x[:-1], y[:-1]]), np.column_stack([x[1:], y[1:]])], axis=1)
+        ax.add_collection(LineCollection(segments, colors=colors[:-1], linewidths=3))
+    # Markers shrink as points get denser so they don't merge into a band
+    marker_size = 36 if len(x) <= 100 else 12 if len(x) <= 400 else 4
+    ax.scatter(x, y, c=colors, s=marker_size, zorder=3)
+
+    ax.set_ylabel("Sentiment Score", color=TEXT)
+    ax.set_xlabel("Date", color=TEXT)
+    ax.tick_params(colors=TEXT)
+    ax.xaxis_date()
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
+    ax.autoscale_view()
+    ax.grid(alpha=0.2, color=TEXT)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", facecolor=BACKGROUND)
+    return buffer.getvalue()
@@ -1,6 +1,85 @@
 MODEL = "models/gemini-2.5-flash"
 DB_FILE = "journal_entries.db"
 
+# SQLite connection pool (WAL mode). Connections are reused across Streamlit sessions.
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_MB = 16
+DB_MMAP_SIZE_MB = 64
+
+# Local Ollama server used before falling back to Gemini. keep_alive keeps the model loaded
+# between requests; timeouts are (connect, read) seconds.
+OLLAMA_URL = "http://localhost:11434"
+OLLAMA_MODEL = "gemma3:1b"
+OLLAMA_KEEP_ALIVE = "30m"
+OLLAMA_CONNECT_TIMEOUT = 2
+OLLAMA_READ_TIMEOUT = 60
+
+# Reflection backends, tried in this order until one answers ("ollama", "gemini")
+REFLECTION_PROVIDERS = ["ollama", "gemini"]
+
+# How the reflection providers are dispatched:
+#   "sequential" - the next provider starts only once the previous one has failed
+#   "hedged"     - the next provider also starts if the current one is slower than its own p95
+#                  latency (HEDGE_DEFAULT_DELAY_MS until it has HEDGE_MIN_SAMPLES requests)
+#   "race"       - all providers start at once
+# Either way the first valid JSON response wins and the others are cancelled.
+REFLECTION_DISPATCH = "hedged"
+HEDGE_DEFAULT_DELAY_MS = 3000
+HEDGE_MIN_SAMPLES = 20
+
+# A provider that fails this many times in a row is skipped for CIRCUIT_RESET_SECONDS,
+# then given one trial request
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_RESET_SECONDS = 30
+
+# Generated reflections are cached in the database, keyed on the entry, emotion, prompt sentiment
+# band, provider models and prompt template version. Entries expire after the TTL and the least
+# recently used ones are evicted beyond the size bound.
+REFLECTION_CACHE = True
+REFLECTION_CACHE_TTL_HOURS = 24 * 7
+REFLECTION_CACHE_MAX_ENTRIES = 1000
+# Opt-in: also reuse the reflection of a different entry with the same scope whose EMBEDDING_MODEL
+# cosine similarity is at least REFLECTION_CACHE_SIMILARITY
+REFLECTION_CACHE_NEAR_DUPLICATES = False
+REFLECTION_CACHE_SIMILARITY = 0.95
+
+# Worker threads that run a Journal submission's emotion, crisis and similarity stages
+PIPELINE_WORKERS = 4
+
+# Load heavy NLP models in a background thread when the app starts
+WARM_UP_MODELS = True
+
+# Zero-shot NLI model for emotion detection. For faster CPU inference a distilled
+# model such as "valhalla/distilbart-mnli-12-1" can be used instead.
+EMOTION_MODEL = "facebook/bart-large-mnli"
+
+# Inference backend for the emotion model:
+#   "pytorch"   - fp32 PyTorch (reference)
+#   "quantized" - PyTorch with dynamic int8 quantization of Linear layers
+#   "onnx"      - ONNX Runtime export (requires optimum[onnxruntime])
+EMOTION_BACKEND = "pytorch"
+EMOTION_ONNX_DIR = ".models/onnx"
+
+# How emotions are classified:
+#   "zero-shot" - one NLI pass per label (15 per entry) with EMOTION_MODEL
+#   "embedding" - one EMBEDDING_MODEL pass per entry, compared against label prototype vectors
+EMOTION_CLASSIFIER = "zero-shot"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = ".models/embeddings"
+
+# The similar-entry TF-IDF index keeps its vocabulary frozen between fits. It is refitted
+# in the background once the entries added since the last fit reach this fraction of the
+# corpus (and at least SIMILARITY_MIN_REBUILD entries).
+SIMILARITY_REBUILD_RATIO = 0.2
+SIMILARITY_MIN_REBUILD = 50
+
+# Entries shown per page in the Search & Filter tab
+SEARCH_PAGE_SIZE = 20
+
+# Maximum number of cached emotion/sentiment results kept in the database (LRU eviction)
+ANALYSIS_CACHE_MAX_ENTRIES = 5000
+
 # Enhanced crisis detection keywords
 CRISIS_WORDS = [
     # Suicidal ideation
@@ -9,7 +88,7 @@ CRISIS_WORDS = [
     
     # Self-harm
     "cutting", "self harm", "hurt myself", "starving", "overdose", 
-    "harm myself", "slice", "bleed",
+    "harm myself", "bleed", "slice my", "slice myself", "slicing my", "slit my", "slit my wrists",
     
     # Hopelessness
     "everything's pointless", "give up", "can't take it", "never get better", 
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+from database import data_version
+from model_registry import sys_state
+
+# Process-wide cache state, shared by every Streamlit session. Like the model registry it is
+# anchored on the ``sys`` module so that a script re-run or module reload keeps the cache.
+_STATE_ATTR = "_reflectai_data_cache"
+
+# Least recently used keys beyond this are dropped
+MAX_CACHED_VALUES = 64
+
+
+def _new_state():
+    return {
+        "lock": threading.Lock(),
+        "values": OrderedDict(),
+        "stats": {},
+    }
+
+
+def _state():
+    return sys_state(_STATE_ATTR, _new_state)
+
+
+def cached(key, compute, version=None):
+    """
+    Returns compute() for this key, computing it only if the journal has changed since the
+    cached value was made. version defaults to database.data_version(); pass it in when
+    making several lookups in one script run to read it once.
+
+    Values are shared between sessions and must be treated as read-only by callers.
+    """
+    state = _state()
+    if version is None:
+        version = data_version()
+
+    with state["lock"]:
+        stats = state["stats"].setdefault(key, {"hits": 0, "misses": 0, "compute_ms": 0.0})
+        entry = state["values"].get(key)
+        if entry is not None and entry[0] == version:
+            state["values"].move_to_end(key)
+            stats["hits"] += 1
+            return entry[1]
+        stats["misses"] += 1
+
+    start = time.perf_counter()
+    value = compute()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    with state["lock"]:
+        stats["compute_ms"] = round(elapsed_ms, 1)
+        state["values"][key] = (version, value)
+        state["values"].move_to_end(key)
+        while len(state["values"]) > MAX_CACHED_VALUES:
+            state["values"].popitem(last=False)
+    return value
+
+
+def clear():
+    state = _state()
+    with state["lock"]:
+        state["values"].clear()
+
+
+def cache_stats():
+    """
+    Returns hit/miss counters per cache key and in total, with hit rates.
+    compute_ms is how long the last miss for that key took to compute.
+    """
+    state = _state()
+    with state["lock"]:
+        keys = {key: dict(stats) for key, stats in state["stats"].items()}
+    for stats in keys.values():
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    hits = sum(stats["hits"] for stats in keys.values())
+    misses = sum(stats["misses"] for stats in keys.values())
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "keys": keys,
+    }
@@ -1,43 +1,952 @@
+import ast
+import calendar
+import datetime
+import json
+import queue
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 import pandas as pd
-from config import DB_FILE
+from config import (
+    DB_FILE, ANALYSIS_CACHE_MAX_ENTRIES,
+    DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_MB, DB_MMAP_SIZE_MB
+)
+
+# Process-wide counters for the emotion analysis cache
+_analysis_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_analysis_cache_stats_lock = threading.Lock()
+
+# Keep IN (...) lists below SQLite's bound-parameter limit
+_MAX_SQL_PARAMS = 900
+
+# Callbacks run after a journal entry is saved: fn(row_id, data)
+_insert_hooks = []
+
+def register_insert_hook(fn):
+    """Registers fn(row_id, data) to be called after every insert_entry."""
+    if fn not in _insert_hooks:
+        _insert_hooks.append(fn)
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections to one database file.
+
+    Connections are opened once in WAL mode (readers never block the writer and vice
+    versa) and reused, so each keeps its prepared-statement cache warm. Reads borrow one of
+    max_connections pooled connections. Writes go through transaction(), which uses a single
+    dedicated writer connection (so a busy read pool can never starve writers), serializes
+    writers in this process and takes the SQLite write lock up front with BEGIN IMMEDIATE;
+    writers from other processes wait up to DB_BUSY_TIMEOUT_MS instead of failing with
+    "database is locked".
+    """
+
+    def __init__(self, path, max_connections=DB_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._all = []
+        self._all_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,  # a connection is only ever used by the thread that borrowed it
+            isolation_level=None,     # autocommit; transactions are explicit
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode; only an OS crash can lose the last commits
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_MB * 1024}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024}")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._all_lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection for reads (autocommit)."""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def transaction(self):
+        """Yields the writer connection inside a write transaction; commits on success, rolls back on error."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        with self._all_lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all.clear()
+        self._idle = queue.LifoQueue()
+        self._writer = None
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool():
+    """Returns the connection pool for the current DB_FILE."""
+    with _pools_lock:
+        pool = _pools.get(DB_FILE)
+        if pool is None:
+            pool = _pools[DB_FILE] = ConnectionPool(DB_FILE)
+        return pool
+
+def close_pools():
+    """Closes every pooled connection, e.g. before deleting or replacing the database file."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
 
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+    """Creates the database if needed and applies any pending schema migrations."""
+    migrate(get_pool())
+
+def _schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(pool):
+    """
+    Brings the database up to the latest version in MIGRATIONS, tracked in PRAGMA user_version.
+    Each migration commits its own version bump, so an interrupted upgrade resumes where it stopped.
+    """
+    with pool.connection() as conn:
+        version = _schema_version(conn)
+    for target, step in MIGRATIONS:
+        if version < target:
+            step(pool)
+            with pool.transaction() as conn:
+                conn.execute(f"PRAGMA user_version = {target}")
+            version = target
+            print(f"✓ Database migrated to schema version {target}")
+
+def _migrate_base_schema(pool):
+    with pool.transaction() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS journals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            entry TEXT,
+            reflection TEXT,
+            summary TEXT,
+            followups TEXT,
+            tone TEXT,
+            safety TEXT,
+            sentiment REAL,
+            emotion TEXT
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            key TEXT PRIMARY KEY,
+            sentiment REAL,
+            emotion TEXT,
+            last_used REAL
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache(last_used)")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS entry_embeddings (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            vector BLOB
+        )
+        """)
+        _init_fts(c)
+
+def _migrate_typed_columns(pool, chunk_size=1000):
+    """
+    Adds `created_at` (integer epoch seconds) next to the display `timestamp`, rewrites
+    `followups` from Python repr to JSON, normalizes `safety`, and indexes the columns
+    the app filters and sorts on. Rows are backfilled in chunks of chunk_size.
+    """
+    with pool.transaction() as c:
+        columns = {row[1] for row in c.execute("PRAGMA table_info(journals)")}
+        if "created_at" not in columns:
+            c.execute("ALTER TABLE journals ADD COLUMN created_at INTEGER")
+
+    last_id = 0
+    while True:
+        with pool.transaction() as c:
+            rows = c.execute(
+                "SELECT id, timestamp, followups, safety FROM journals WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, chunk_size)
+            ).fetchall()
+            if not rows:
+                break
+            c.executemany(
+                "UPDATE journals SET created_at = ?, followups = ?, safety = ? WHERE id = ?",
+                [
+                    (to_epoch(timestamp), _followups_json(followups), normalize_safety(safety), row_id)
+                    for row_id, timestamp, followups, safety in rows
+                ]
+            )
+        last_id = rows[-1][0]
+
+    with pool.transaction() as c:
+        c.execute("CREATE INDEX IF NOT EXISTS idx_journals_created_at ON journals(created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_journals_emotion ON journals(emotion, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_journals_sentiment ON journals(sentiment)")
+        c.execute("ANALYZE journals")
+
+def _migrate_meta(pool):
+    with pool.transaction() as c:
+        c.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value INTEGER)")
+        c.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('data_version', 0)")
+
+def _migrate_aggregates(pool):
+    with pool.transaction() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS agg_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            count INTEGER, mean REAL, m2 REAL, min REAL, max REAL,
+            first_at INTEGER, last_at INTEGER, last_emotion TEXT
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS agg_week (
+            week TEXT PRIMARY KEY,
+            count INTEGER, mean REAL, m2 REAL, min REAL, max REAL
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS agg_emotion_band (
+            emotion TEXT, band TEXT, count INTEGER,
+            PRIMARY KEY (emotion, band)
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS agg_transition (
+            from_emotion TEXT, to_emotion TEXT, count INTEGER,
+            PRIMARY KEY (from_emotion, to_emotion)
+        )
+        """)
+        rebuild_aggregates(c)
+
+def _migrate_reflection_cache(pool):
+    with pool.transaction() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS reflection_cache (
+            key TEXT PRIMARY KEY,
+            scope TEXT,
+            response TEXT,
+            vector BLOB,
+            latency_ms REAL,
+            created_at REAL,
+            last_used REAL
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reflection_cache_scope ON reflection_cache(scope, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reflection_cache_last_used ON reflection_cache(last_used)")
+
+# (version, migration) pairs, applied in order to databases below that version
+MIGRATIONS = [
+    (1, _migrate_base_schema),
+    (2, _migrate_typed_columns),
+    (3, _migrate_meta),
+    (4, _migrate_aggregates),
+    (5, _migrate_reflection_cache),
+]
+
+def to_epoch(value):
+    """
+    Converts an ISO timestamp string or datetime to integer epoch seconds (None if unparseable).
+    Naive timestamps, which is what the app writes, are taken as UTC so that SQLite's
+    date(created_at, 'unixepoch') gives back the same calendar day the user saw.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, datetime.datetime):
+        try:
+            value = datetime.datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        return int(value.timestamp())
+    return calendar.timegm(value.timetuple())
+
+def _followups_json(value):
+    """
+    Returns followups as a JSON list, accepting lists, JSON text or the legacy str(list) repr.
+    Follow-up dicts are kept as JSON objects.
+    """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                value = [value] if value.strip() else []
+    if value is None:
+        value = []
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return json.dumps(list(value), default=str)
+
+# Canonical values of the `safety` column
+SAFETY_VALUES = ("safe", "flagged", "moderate", "high", "critical", "unknown")
+
+def normalize_safety(value):
+    """
+    Maps the mixed safety values the app has written over time (bools, crisis levels,
+    "none", "error", ...) onto SAFETY_VALUES.
+    """
+    if value is None or value is False:
+        return "safe"
+    if value is True:
+        return "flagged"
+    value = str(value).strip().lower()
+    if value in SAFETY_VALUES:
+        return value
+    if value in ("", "0", "false", "none", "no"):
+        return "safe"
+    if value in ("1", "true", "yes", "crisis"):
+        return "flagged"
+    return "unknown"
+
+def _init_fts(c):
+    """
+    Creates the FTS5 index over journal entries, kept in sync with `journals` by triggers.
+    Silently skipped if this SQLite build has no FTS5; search_entries then falls back to LIKE.
+    """
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'journals_fts'").fetchone()
+    try:
+        c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS journals_fts USING fts5(
+            entry, content='journals', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+    except sqlite3.OperationalError:
+        return
     c.execute("""
-    CREATE TABLE IF NOT EXISTS journals (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
-        entry TEXT,
-        reflection TEXT,
-        summary TEXT,
-        followups TEXT,
-        tone TEXT,
-        safety TEXT,
-        sentiment REAL,
-        emotion TEXT
-    )
+    CREATE TRIGGER IF NOT EXISTS journals_fts_ai AFTER INSERT ON journals BEGIN
+        INSERT INTO journals_fts(rowid, entry) VALUES (new.id, new.entry);
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS journals_fts_ad AFTER DELETE ON journals BEGIN
+        INSERT INTO journals_fts(journals_fts, rowid, entry) VALUES ('delete', old.id, old.entry);
+    END
     """)
-    conn.commit()
-    conn.close()
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS journals_fts_au AFTER UPDATE OF entry ON journals BEGIN
+        INSERT INTO journals_fts(journals_fts, rowid, entry) VALUES ('delete', old.id, old.entry);
+        INSERT INTO journals_fts(rowid, entry) VALUES (new.id, new.entry);
+    END
+    """)
+    if not exists:
+        # Index the entries written before the FTS table existed
+        c.execute("INSERT INTO journals_fts(journals_fts) VALUES ('rebuild')")
 
 def insert_entry(data):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO journals (timestamp, entry, reflection, summary, followups, tone, safety, sentiment, emotion)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        data["timestamp"], data["entry"], data["reflection"], data["summary"],
-        str(data["followups"]), data["tone"], data["safety"],
-        data["sentiment"], data["emotion"]
-    ))
-    conn.commit()
-    conn.close()
-
-def load_entries():
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM journals ORDER BY timestamp DESC", conn)
-    conn.close()
-    return df
+    """Saves a journal entry and returns its row id."""
+    with get_pool().transaction() as conn:
+        c = conn.execute("""
+            INSERT INTO journals (timestamp, created_at, entry, reflection, summary, followups, tone, safety, sentiment, emotion)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            data["timestamp"], to_epoch(data["timestamp"]), data["entry"], data["reflection"], data["summary"],
+            _followups_json(data["followups"]), data["tone"], normalize_safety(data["safety"]),
+            data["sentiment"], data["emotion"]
+        ))
+        row_id = c.lastrowid
+        if not _update_aggregates(conn, to_epoch(data["timestamp"]), data["sentiment"], data["emotion"]):
+            # Older than the latest entry: the transition chain has to be recomputed in time order
+            rebuild_aggregates(conn)
+        _bump_data_version(conn)
+
+    for hook in _insert_hooks:
+        # Derived data (indexes, caches) must never stop an entry from being saved
+        try:
+            hook(row_id, data)
+        except Exception as e:
+            print(f"⚠️ Insert hook {getattr(hook, '__name__', hook)} failed: {e}")
+    return row_id
+
+# ============================
+# Materialized analytics aggregates
+# ============================
+# Kept up to date inside insert_entry so dashboards read a few small tables instead of every row:
+#   agg_state        - Welford count/mean/M2 plus min/max of sentiment over all entries, and the
+#                      latest entry's time and emotion (the tail of the transition chain)
+#   agg_week         - the same sentiment statistics per ISO week ("2025-W07")
+#   agg_emotion_band - entry counts per (emotion, sentiment band)
+#   agg_transition   - how often each emotion directly followed another, in time order
+
+def sentiment_band(sentiment):
+    """'positive' above 0.3, 'negative' below -0.3, otherwise 'neutral'."""
+    return "positive" if sentiment > 0.3 else "negative" if sentiment < -0.3 else "neutral"
+
+def _welford(stats, x):
+    """Adds x to (count, mean, m2, min, max) using Welford's update."""
+    count, mean, m2, low, high = stats
+    count += 1
+    delta = x - mean
+    mean += delta / count
+    m2 += delta * (x - mean)
+    low = x if low is None else min(low, x)
+    high = x if high is None else max(high, x)
+    return count, mean, m2, low, high
+
+_EMPTY_STATS = (0, 0.0, 0.0, None, None)
+
+def _iso_week(created_at):
+    year, week, _ = datetime.datetime.fromtimestamp(created_at, datetime.timezone.utc).isocalendar()
+    return f"{year}-W{week:02d}"
+
+def _update_aggregates(c, created_at, sentiment, emotion):
+    """
+    Folds one new entry into the aggregate tables. Returns False without changing anything
+    if the entry is older than the latest one, in which case the caller must rebuild.
+    """
+    state = c.execute(
+        "SELECT count, mean, m2, min, max, first_at, last_at, last_emotion FROM agg_state WHERE id = 1"
+    ).fetchone()
+    stats, first_at, last_at, last_emotion = (state[:5], state[5], state[6], state[7]) if state else (_EMPTY_STATS, None, None, None)
+    if created_at is not None and last_at is not None and created_at < last_at:
+        return False
+
+    if sentiment is not None:
+        stats = _welford(stats, sentiment)
+        if created_at is not None:
+            week = _iso_week(created_at)
+            row = c.execute("SELECT count, mean, m2, min, max FROM agg_week WHERE week = ?", (week,)).fetchone()
+            c.execute(
+                "INSERT OR REPLACE INTO agg_week (week, count, mean, m2, min, max) VALUES (?, ?, ?, ?, ?, ?)",
+                (week, *_welford(row or _EMPTY_STATS, sentiment))
+            )
+    if emotion is not None:
+        if sentiment is not None:
+            c.execute("""
+                INSERT INTO agg_emotion_band (emotion, band, count) VALUES (?, ?, 1)
+                ON CONFLICT (emotion, band) DO UPDATE SET count = count + 1
+            """, (emotion, sentiment_band(sentiment)))
+        if last_emotion is not None:
+            c.execute("""
+                INSERT INTO agg_transition (from_emotion, to_emotion, count) VALUES (?, ?, 1)
+                ON CONFLICT (from_emotion, to_emotion) DO UPDATE SET count = count + 1
+            """, (last_emotion, emotion))
+        last_emotion = emotion
+    if created_at is not None:
+        first_at = created_at if first_at is None else first_at
+        last_at = created_at
+
+    c.execute(
+        "INSERT OR REPLACE INTO agg_state (id, count, mean, m2, min, max, first_at, last_at, last_emotion) "
+        "VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (*stats, first_at, last_at, last_emotion)
+    )
+    return True
+
+def rebuild_aggregates(c, chunk_size=5000):
+    """Recomputes every aggregate table from the journal in one pass, in time order."""
+    stats, first_at, last_at, last_emotion = _EMPTY_STATS, None, None, None
+    weeks, bands, transitions = {}, {}, {}
+    cursor = c.execute("SELECT created_at, sentiment, emotion FROM journals ORDER BY created_at, id")
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for created_at, sentiment, emotion in rows:
+            if sentiment is not None:
+                stats = _welford(stats, sentiment)
+                if created_at is not None:
+                    week = _iso_week(created_at)
+                    weeks[week] = _welford(weeks.get(week, _EMPTY_STATS), sentiment)
+            if emotion is not None:
+                if sentiment is not None:
+                    key = (emotion, sentiment_band(sentiment))
+                    bands[key] = bands.get(key, 0) + 1
+                if last_emotion is not None:
+                    key = (last_emotion, emotion)
+                    transitions[key] = transitions.get(key, 0) + 1
+                last_emotion = emotion
+            if created_at is not None:
+                first_at = created_at if first_at is None else first_at
+                last_at = created_at
+
+    for table in ("agg_state", "agg_week", "agg_emotion_band", "agg_transition"):
+        c.execute(f"DELETE FROM {table}")
+    c.execute(
+        "INSERT INTO agg_state (id, count, mean, m2, min, max, first_at, last_at, last_emotion) "
+        "VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (*stats, first_at, last_at, last_emotion)
+    )
+    c.executemany(
+        "INSERT INTO agg_week (week, count, mean, m2, min, max) VALUES (?, ?, ?, ?, ?, ?)",
+        [(week, *week_stats) for week, week_stats in weeks.items()]
+    )
+    c.executemany(
+        "INSERT INTO agg_emotion_band (emotion, band, count) VALUES (?, ?, ?)",
+        [(emotion, band, count) for (emotion, band), count in bands.items()]
+    )
+    c.executemany(
+        "INSERT INTO agg_transition (from_emotion, to_emotion, count) VALUES (?, ?, ?)",
+        [(a, b, count) for (a, b), count in transitions.items()]
+    )
+
+def _std(count, m2):
+    # Sample standard deviation, like pandas' Series.std()
+    return (m2 / (count - 1)) ** 0.5 if count > 1 else float("nan")
+
+def get_aggregates():
+    """
+    Returns the materialized analytics:
+      sentiment:     {count, average, std_dev, highest, lowest}
+      first_at, last_at: epoch seconds of the oldest and newest entry
+      emotion_bands: {emotion: {band: count}} with bands from sentiment_band()
+      weekly:        DataFrame indexed by ISO week with mean/min/max/std/count of sentiment
+      transitions:   {(from_emotion, to_emotion): count}
+    """
+    with get_pool().connection() as conn:
+        state = conn.execute(
+            "SELECT count, mean, m2, min, max, first_at, last_at FROM agg_state WHERE id = 1"
+        ).fetchone() or (0, 0.0, 0.0, None, None, None, None)
+        bands = conn.execute("SELECT emotion, band, count FROM agg_emotion_band").fetchall()
+        weeks = conn.execute("SELECT week, count, mean, m2, min, max FROM agg_week ORDER BY week").fetchall()
+        transitions = conn.execute("SELECT from_emotion, to_emotion, count FROM agg_transition").fetchall()
+
+    count, mean, m2, low, high, first_at, last_at = state
+    emotion_bands = {}
+    for emotion, band, n in bands:
+        emotion_bands.setdefault(emotion, {})[band] = n
+    weekly = pd.DataFrame(
+        [
+            {"week": week, "mean": w_mean, "min": w_min, "max": w_max, "std": _std(n, w_m2), "count": n}
+            for week, n, w_mean, w_m2, w_min, w_max in weeks
+        ],
+        columns=["week", "mean", "min", "max", "std", "count"]
+    ).set_index("week")
+    return {
+        "sentiment": {
+            "count": count,
+            "average": mean if count else float("nan"),
+            "std_dev": _std(count, m2),
+            "highest": high,
+            "lowest": low,
+        },
+        "first_at": first_at,
+        "last_at": last_at,
+        "emotion_bands": emotion_bands,
+        "weekly": weekly,
+        "transitions": {(a, b): n for a, b, n in transitions},
+    }
+
+def _bump_data_version(conn):
+    conn.execute("UPDATE db_meta SET value = value + 1 WHERE key = 'data_version'")
+
+def data_version():
+    """
+    Returns a counter that changes whenever journal rows are inserted or re-analyzed.
+    Cached data derived from the journal is valid for as long as this stays the same.
+    """
+    with get_pool().connection() as conn:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'data_version'").fetchone()
+    return row[0] if row else 0
+
+JOURNAL_COLUMNS = (
+    "id", "timestamp", "created_at", "entry", "reflection", "summary",
+    "followups", "tone", "safety", "sentiment", "emotion",
+)
+
+def load_entries(columns=None, limit=None, offset=0, cursor=None, start=None, end=None,
+                 sentiment_below=None, ascending=False):
+    """
+    Loads journal entries ordered by time (newest first unless ascending=True).
+
+    columns: names from JOURNAL_COLUMNS to read; None reads all of them. Only ask for
+        `entry`/`reflection` when they are shown, they are most of each row.
+    limit, offset: one page of rows. With a limit, `id` and `created_at` are always
+        returned so the last row can be passed back as cursor.
+    cursor: (created_at, id) of the last row of the previous page; the next page is read
+        with an index seek instead of skipping `offset` rows.
+    start, end: date window [start, end) as datetimes, ISO strings or epoch seconds.
+    sentiment_below: only entries with sentiment strictly below this value.
+    """
+    if columns is None:
+        columns = list(JOURNAL_COLUMNS)
+    else:
+        columns = list(dict.fromkeys(columns))
+        unknown = set(columns) - set(JOURNAL_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown journal columns: {sorted(unknown)}")
+        if limit is not None:
+            columns += [c for c in ("id", "created_at") if c not in columns]
+
+    where, params = [], []
+    if start is not None:
+        where.append("created_at >= ?")
+        params.append(to_epoch(start))
+    if end is not None:
+        where.append("created_at < ?")
+        params.append(to_epoch(end))
+    if sentiment_below is not None:
+        where.append("sentiment < ?")
+        params.append(sentiment_below)
+    if cursor is not None:
+        where.append(f"(created_at, id) {'>' if ascending else '<'} (?, ?)")
+        params.extend(cursor)
+
+    direction = "ASC" if ascending else "DESC"
+    sql = f"SELECT {', '.join(columns)} FROM journals"
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    sql += f" ORDER BY created_at {direction}, id {direction}"
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+# SQLite date expressions giving the start of each trend bucket (created_at is epoch seconds, UTC)
+_BUCKET_SQL = {
+    "D": "date(created_at, 'unixepoch')",
+    "W": "date(created_at, 'unixepoch', 'weekday 0', '-6 days')",  # Monday of the ISO week
+    "M": "date(created_at, 'unixepoch', 'start of month')",
+}
+
+_WEEK_SECONDS = 7 * 86400
+# 1970-01-01 was a Thursday; the first Monday 00:00 UTC is four days later
+_FIRST_MONDAY = 4 * 86400
+
+def _week_aligned(epoch):
+    return epoch is None or (epoch - _FIRST_MONDAY) % _WEEK_SECONDS == 0
+
+def _weekly_buckets(start=None, end=None):
+    # Reads the materialized agg_week rows: one row per ISO week instead of every entry
+    where, params = [], []
+    if start is not None:
+        where.append("week >= ?")
+        params.append(_iso_week(start))
+    if end is not None:
+        where.append("week < ?")
+        params.append(_iso_week(end))
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f"SELECT week, mean, min, max, count FROM agg_week "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY week",
+            params
+        ).fetchall()
+    df = pd.DataFrame(rows, columns=["bucket", "mean", "min", "max", "count"])
+    df["sum"] = df["mean"] * df["count"]
+    df["bucket"] = pd.to_datetime(
+        [datetime.date.fromisocalendar(int(week[:4]), int(week[6:]), 1) for week in df["bucket"]]
+    )
+    return df.set_index("bucket")
+
+def sentiment_buckets(freq="W", start=None, end=None):
+    """
+    Aggregates sentiment per day ("D"), ISO week ("W") or month ("M"). Returns a DataFrame
+    indexed by bucket start date with columns mean, min, max, count and sum; buckets without
+    entries are absent. Weeks come from the agg_week aggregate when the window is whole weeks
+    (or open); everything else is a GROUP BY over the created_at index.
+    """
+    start, end = to_epoch(start), to_epoch(end)
+    if freq == "W" and _week_aligned(start) and _week_aligned(end):
+        return _weekly_buckets(start, end)
+    bucket = _BUCKET_SQL[freq]
+    where, params = ["sentiment IS NOT NULL", "created_at IS NOT NULL"], []
+    if start is not None:
+        where.append("created_at >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("created_at < ?")
+        params.append(end)
+    with get_pool().connection() as conn:
+        df = pd.read_sql_query(f"""
+            SELECT {bucket} AS bucket, AVG(sentiment) AS mean, MIN(sentiment) AS min, MAX(sentiment) AS max,
+                   COUNT(*) AS count, SUM(sentiment) AS sum
+            FROM journals
+            WHERE {' AND '.join(where)}
+            GROUP BY bucket
+            ORDER BY bucket
+        """, conn, params=params)
+    df["bucket"] = pd.to_datetime(df["bucket"])
+    return df.set_index("bucket")
+
+def next_cursor(page):
+    """Returns the cursor for the page after `page` (a load_entries result), or None at the end."""
+    if page.empty:
+        return None
+    last = page.iloc[-1]
+    return int(last["created_at"]), int(last["id"])
+
+SEARCH_ORDERS = {
+    "newest": "j.created_at DESC",
+    "oldest": "j.created_at ASC",
+    "most_positive": "j.sentiment DESC",
+    "most_negative": "j.sentiment ASC",
+    "relevance": "bm25(journals_fts)",
+}
+
+def _fts_query(text):
+    # Every word must appear, as a prefix ("stress" also finds "stressed"); quoting
+    # each token keeps FTS5 operators and punctuation in user input from being parsed.
+    tokens = re.findall(r"\w+", text)
+    return " ".join(f'"{token}"*' for token in tokens)
+
+def _has_fts():
+    with get_pool().connection() as conn:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'journals_fts'").fetchone() is not None
+
+def search_entries(query=None, emotions=None, sentiment_range=None, order="newest", limit=20, offset=0):
+    """
+    Searches journal entries with the keyword, emotion and sentiment filters applied in SQL.
+    order: one of SEARCH_ORDERS ('relevance' needs a keyword query).
+    Returns (DataFrame with one page of matching rows, total number of matches).
+    """
+    joins, where, params = [], [], []
+    query = query.strip() if query else ""
+    match = _fts_query(query)
+    # A query with no word characters ("!!!") has nothing for FTS to match, so it is
+    # searched for literally instead of being dropped and matching every entry
+    has_fts = bool(match) and _has_fts()
+
+    if has_fts:
+        joins.append("JOIN journals_fts ON journals_fts.rowid = j.id")
+        where.append("journals_fts MATCH ?")
+        params.append(match)
+    elif query:
+        where.append("j.entry LIKE ? ESCAPE '\\'")
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+    if emotions:
+        where.append(f"j.emotion IN ({','.join('?' * len(emotions))})")
+        params.extend(emotions)
+    if sentiment_range:
+        where.append("j.sentiment BETWEEN ? AND ?")
+        params.extend(sentiment_range)
+
+    if order == "relevance" and not has_fts:
+        order = "newest"
+    order_by = SEARCH_ORDERS[order]
+
+    from_clause = " ".join(["FROM journals j"] + joins)
+    where_clause = f"WHERE {' AND '.join(where)}" if where else ""
+    with get_pool().connection() as conn:
+        total = conn.execute(f"SELECT COUNT(*) {from_clause} {where_clause}", params).fetchone()[0]
+        df = pd.read_sql_query(
+            f"""
+            SELECT j.id, j.timestamp, j.entry, j.reflection, j.summary, j.sentiment, j.emotion
+            {from_clause} {where_clause}
+            ORDER BY {order_by}, j.id DESC
+            LIMIT ? OFFSET ?
+            """,
+            conn, params=params + [limit, offset]
+        )
+    return df, total
+
+def get_emotion_options():
+    """Returns the distinct emotions in the journal, sorted."""
+    with get_pool().connection() as conn:
+        rows = conn.execute("SELECT DISTINCT emotion FROM journals WHERE emotion IS NOT NULL ORDER BY emotion").fetchall()
+    return [row[0] for row in rows]
+
+def load_entries_by_ids(ids):
+    """Returns the rows with the given ids as a DataFrame, in the order of ids."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return pd.DataFrame()
+    frames = []
+    with get_pool().connection() as conn:
+        for start in range(0, len(ids), _MAX_SQL_PARAMS):
+            chunk = ids[start:start + _MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            frames.append(pd.read_sql_query(f"SELECT * FROM journals WHERE id IN ({placeholders})", conn, params=chunk))
+    df = pd.concat(frames, ignore_index=True).set_index("id", drop=False)
+    return df.loc[[i for i in ids if i in df.index]].reset_index(drop=True)
+
+def iter_entry_texts(chunk_size=512, after_id=0):
+    """Yields (id, entry) rows in id order, chunk_size rows at a time, starting after after_id."""
+    last_id = after_id
+    while True:
+        with get_pool().connection() as conn:
+            rows = conn.execute(
+                "SELECT id, entry FROM journals WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, chunk_size)
+            ).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def update_analysis(rows, refresh=True):
+    """
+    Updates sentiment and emotion for many entries. rows: [(sentiment, emotion, id), ...]
+    Batch callers pass refresh=False and call refresh_analysis() once after the last batch,
+    since rebuilding the aggregates reads the whole journal.
+    """
+    with get_pool().transaction() as conn:
+        conn.executemany("UPDATE journals SET sentiment = ?, emotion = ? WHERE id = ?", rows)
+        if refresh:
+            rebuild_aggregates(conn)
+            _bump_data_version(conn)
+
+def refresh_analysis():
+    """Rebuilds the aggregates and invalidates cached journal data after update_analysis(refresh=False)."""
+    with get_pool().transaction() as conn:
+        rebuild_aggregates(conn)
+        _bump_data_version(conn)
+
+def get_cached_analyses(keys):
+    """
+    Looks up cached (sentiment, emotion) results by content key.
+    Returns {key: (sentiment, emotion)} for the keys that were found and marks them as recently used.
+    """
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    with get_pool().connection() as conn:
+        for start in range(0, len(keys), _MAX_SQL_PARAMS):
+            chunk = keys[start:start + _MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT key, sentiment, emotion FROM analysis_cache WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            found.update({key: (sentiment, emotion) for key, sentiment, emotion in rows})
+    if found:
+        now = time.time()
+        with get_pool().transaction() as conn:
+            conn.executemany("UPDATE analysis_cache SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+
+    _count_analysis_cache(hits=len(found), misses=len(keys) - len(found))
+    return found
+
+def put_cached_analyses(items):
+    """
+    Stores analysis results. items: [(key, sentiment, emotion), ...]
+    Evicts the least recently used rows once the cache grows past ANALYSIS_CACHE_MAX_ENTRIES.
+    """
+    now = time.time()
+    with get_pool().transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO analysis_cache (key, sentiment, emotion, last_used) VALUES (?, ?, ?, ?)",
+            [(key, sentiment, emotion, now) for key, sentiment, emotion in items]
+        )
+        count = conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        if count > ANALYSIS_CACHE_MAX_ENTRIES:
+            evicted = conn.execute("""
+                DELETE FROM analysis_cache WHERE key IN (
+                    SELECT key FROM analysis_cache ORDER BY last_used ASC LIMIT ?
+                )
+            """, (count - ANALYSIS_CACHE_MAX_ENTRIES,)).rowcount
+            _count_analysis_cache(evictions=evicted)
+
+def _count_analysis_cache(**increments):
+    # Sessions analyse concurrently, and += on a shared dict can lose updates between threads
+    with _analysis_cache_stats_lock:
+        for name, value in increments.items():
+            _analysis_cache_stats[name] += value
+
+def analysis_cache_stats():
+    """Returns hit/miss/eviction counters for this process, plus the hit rate."""
+    with _analysis_cache_stats_lock:
+        stats = dict(_analysis_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+def get_embeddings(keys):
+    """Returns {key: float32 vector bytes} for the stored embeddings among keys."""
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    with get_pool().connection() as conn:
+        for start in range(0, len(keys), _MAX_SQL_PARAMS):
+            chunk = keys[start:start + _MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT key, vector FROM entry_embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            found.update(dict(rows))
+    return found
+
+def put_embeddings(items):
+    """Stores embeddings. items: [(key, model, vector_bytes), ...]"""
+    with get_pool().transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO entry_embeddings (key, model, vector) VALUES (?, ?, ?)", items)
+
+def get_cached_reflection(key, min_created):
+    """
+    Returns (response_json, latency_ms) for a reflection cached under key no earlier than
+    min_created (epoch seconds), marking it as recently used; None if there is none.
+    """
+    with get_pool().connection() as conn:
+        row = conn.execute(
+            "SELECT response, latency_ms FROM reflection_cache WHERE key = ? AND created_at >= ?",
+            (key, min_created)
+        ).fetchone()
+    if row is not None:
+        with get_pool().transaction() as conn:
+            conn.execute("UPDATE reflection_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+    return row
+
+def get_reflection_vectors(scope, min_created):
+    """Returns [(key, vector_bytes), ...] for the unexpired cached reflections in scope that have a vector."""
+    with get_pool().connection() as conn:
+        return conn.execute(
+            "SELECT key, vector FROM reflection_cache WHERE scope = ? AND created_at >= ? AND vector IS NOT NULL",
+            (scope, min_created)
+        ).fetchall()
+
+def put_cached_reflection(key, scope, response_json, latency_ms, vector, min_created, max_entries):
+    """
+    Stores a generated reflection, drops entries created before min_created and evicts the
+    least recently used ones beyond max_entries. Returns (expired, evicted) row counts.
+    """
+    now = time.time()
+    with get_pool().transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO reflection_cache "
+            "(key, scope, response, vector, latency_ms, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, scope, response_json, vector, latency_ms, now, now)
+        )
+        expired = conn.execute("DELETE FROM reflection_cache WHERE created_at < ?", (min_created,)).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM reflection_cache").fetchone()[0]
+        evicted = 0
+        if count > max_entries:
+            evicted = conn.execute("""
+                DELETE FROM reflection_cache WHERE key IN (
+                    SELECT key FROM reflection_cache ORDER BY last_used ASC LIMIT ?
+                )
+            """, (count - max_entries,)).rowcount
+    return expired, evicted
+
+def reflection_cache_size():
+    with get_pool().connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM reflection_cache").fetchone()[0]
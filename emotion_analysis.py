@@ -1,12 +1,134 @@
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import sqlite3
+import unicodedata
 from textblob import TextBlob
-from transformers import pipeline
-
-# Use a pipeline for zero-shot classification
-emotion_classifier = pipeline(
-    "zero-shot-classification",
-    model="facebook/bart-large-mnli"
+from model_registry import register_model, get_model, is_loaded, warm_up
+from database import (
+    get_cached_analyses, put_cached_analyses, iter_entry_texts, update_analysis, refresh_analysis,
+    get_embeddings, put_embeddings
+)
+from config import (
+    EMOTION_MODEL, EMOTION_BACKEND, EMOTION_ONNX_DIR,
+    EMOTION_CLASSIFIER, EMBEDDING_MODEL, EMBEDDING_CACHE_DIR
 )
 
+EMOTION_MODEL_NAME = EMOTION_MODEL
+EMOTION_BACKENDS = ("pytorch", "quantized", "onnx")
+
+
+def _load_pytorch_classifier(model_name):
+    from transformers import pipeline
+    return pipeline("zero-shot-classification", model=model_name)
+
+
+def _load_quantized_classifier(model_name):
+    # Dynamic int8 quantization of the Linear layers: weights are stored as int8 and
+    # activations are quantized on the fly, which suits CPU-only inference.
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+
+def _load_onnx_classifier(model_name):
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import AutoTokenizer, pipeline
+
+    # Exporting is slow, so the ONNX graph is exported once and reused from disk
+    export_dir = os.path.join(EMOTION_ONNX_DIR, model_name.replace("/", "__"))
+    if os.path.isdir(export_dir):
+        model = ORTModelForSequenceClassification.from_pretrained(export_dir)
+        tokenizer = AutoTokenizer.from_pretrained(export_dir)
+    else:
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model.save_pretrained(export_dir)
+        tokenizer.save_pretrained(export_dir)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+
+def build_emotion_classifier(backend="pytorch", model_name=None):
+    """
+    Builds a zero-shot classifier on the given backend:
+    'pytorch' (fp32), 'quantized' (dynamic int8) or 'onnx' (ONNX Runtime).
+    Falls back to fp32 PyTorch if the backend's optional dependencies are missing; the
+    backend that actually loaded is in the classifier's `loaded_backend` attribute.
+    """
+    model_name = model_name or EMOTION_MODEL_NAME
+    if backend not in EMOTION_BACKENDS:
+        raise ValueError(f"Unknown emotion backend '{backend}', expected one of {EMOTION_BACKENDS}")
+
+    loaders = {
+        "pytorch": _load_pytorch_classifier,
+        "quantized": _load_quantized_classifier,
+        "onnx": _load_onnx_classifier,
+    }
+    try:
+        classifier = loaders[backend](model_name)
+    except ImportError as e:
+        if backend != "onnx":
+            raise
+        print(f"⚠️ ONNX backend unavailable ({e}); install optimum[onnxruntime]. Falling back to PyTorch...")
+        backend = "pytorch"
+        classifier = _load_pytorch_classifier(model_name)
+    classifier.loaded_backend = backend
+    return classifier
+
+
+def _load_emotion_classifier():
+    # Transformers is imported inside the loaders so that importing this module stays cheap
+    return build_emotion_classifier(EMOTION_BACKEND, EMOTION_MODEL_NAME)
+
+
+# The classifier is built lazily on first use and shared by the whole process
+register_model("emotion_classifier", _load_emotion_classifier)
+
+
+def get_emotion_classifier():
+    """Returns the shared zero-shot classifier, loading it on first call."""
+    return get_model("emotion_classifier")
+
+
+@functools.lru_cache(maxsize=None)
+def _onnx_available():
+    try:
+        return importlib.util.find_spec("optimum.onnxruntime") is not None
+    except ImportError:
+        return False
+
+
+def emotion_backend():
+    """
+    The backend the shared classifier runs on: the one that loaded, or, before it has
+    loaded, the one it will load with (EMOTION_BACKEND unless ONNX has to fall back).
+    """
+    if is_loaded("emotion_classifier"):
+        return getattr(get_emotion_classifier(), "loaded_backend", EMOTION_BACKEND)
+    if EMOTION_BACKEND == "onnx" and not _onnx_available():
+        return "pytorch"
+    return EMOTION_BACKEND
+
+
+def warm_up_emotion_classifier(background=True):
+    """Starts loading the classifier ahead of the first analysis."""
+    if EMOTION_CLASSIFIER == "embedding":
+        return warm_up("emotion_prototypes", background=background)
+    return warm_up("emotion_classifier", background=background)
+
+
+def __getattr__(name):
+    # Keeps `emotion_analysis.emotion_classifier` working without an eager load
+    if name == "emotion_classifier":
+        return get_emotion_classifier()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # More granular, mental-health-focused emotion labels
 EMOTION_LABELS = [
     "anxious", "overwhelmed", "lonely", "ashamed", "grieving",
@@ -14,21 +136,280 @@ EMOTION_LABELS = [
     "confused", "unmotivated", "stressed", "peaceful", "neutral"
 ]
 
+# Example phrases per label; their embeddings are averaged into one prototype vector per label
+EMOTION_PROTOTYPES = {
+    "anxious": ["I keep worrying that something bad will happen", "My heart is racing and I can't calm down", "I feel nervous and on edge"],
+    "overwhelmed": ["There is too much to handle and I don't know where to start", "Everything is piling up on me", "I can't keep up with it all"],
+    "lonely": ["I feel so alone", "Nobody reaches out to me", "I wish I had someone to talk to"],
+    "ashamed": ["I'm embarrassed by what I did", "I feel like a failure and a disappointment", "I can't stop blaming myself"],
+    "grieving": ["I miss them so much since they died", "I'm mourning a loss", "Life feels empty without them"],
+    "joyful": ["Today was amazing and I'm so happy", "I couldn't stop smiling", "I feel full of joy"],
+    "content": ["I'm satisfied with how things are", "A calm, pleasant day", "I have what I need right now"],
+    "frustrated": ["Nothing is working the way it should", "I'm fed up with these setbacks", "It's so annoying that I keep getting stuck"],
+    "hopeful": ["I think things are going to get better", "I'm looking forward to what's next", "There is light at the end of the tunnel"],
+    "angry": ["I'm furious about how I was treated", "That made me so mad", "I want to scream at them"],
+    "confused": ["I don't understand what is going on", "I can't figure out what to do", "My thoughts are all mixed up"],
+    "unmotivated": ["I can't make myself do anything", "I have no energy or drive today", "I keep procrastinating"],
+    "stressed": ["I'm under so much pressure", "Work and bills are weighing on me", "I feel tense all the time"],
+    "peaceful": ["I feel calm and at ease", "A quiet, serene moment", "My mind is still and relaxed"],
+    "neutral": ["Nothing special happened today", "It was an ordinary day", "Just a regular routine"],
+}
+
+
+def _normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _classifier_id():
+    if EMOTION_CLASSIFIER == "embedding":
+        return f"embedding:{EMBEDDING_MODEL}"
+    return f"{EMOTION_MODEL_NAME}@{emotion_backend()}"
+
+
+def analysis_cache_key(text):
+    """
+    Content address for a cached analysis: hash of the normalized text,
+    the classifier/model id and the label set, so changing any of them invalidates old results.
+    """
+    payload = "\x1f".join([_classifier_id(), ",".join(EMOTION_LABELS), _normalize_text(text)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_lookup(keys):
+    # The cache is an optimisation only; a missing table or locked DB counts as a miss
+    try:
+        return get_cached_analyses(keys)
+    except sqlite3.Error:
+        return {}
+
+
+def _cache_store(items):
+    try:
+        put_cached_analyses(items)
+    except sqlite3.Error:
+        pass
+
+
 def analyze_emotion(text):
     """
     Analyzes sentiment polarity and categorizes into granular emotion labels
     more relevant to emotional well-being tracking.
+    Results are cached by content, so re-submitting the same entry skips the model.
     """
+    key = analysis_cache_key(text)
+    cached = _cache_lookup([key]).get(key)
+    if cached:
+        return cached
+
     # Get sentiment polarity (-1 to 1)
     sentiment = TextBlob(text).sentiment.polarity
     
-    # Get more specific emotion using zero-shot classification
-    result = emotion_classifier(text, EMOTION_LABELS, multi_label=False)
-    emotion = result['labels'][0].capitalize()
-    
+    # Get more specific emotion using zero-shot classification (or label prototypes)
+    if EMOTION_CLASSIFIER == "embedding":
+        emotion = _classify_emotions_embedding([text])[0]
+    else:
+        result = get_emotion_classifier()(text, EMOTION_LABELS, multi_label=False)
+        emotion = result['labels'][0].capitalize()
+
+    _cache_store([(key, sentiment, emotion)])
     return sentiment, emotion
 
 
+# Same hypothesis template the zero-shot pipeline uses by default
+HYPOTHESIS_TEMPLATE = "This example is {}."
+
+
+def _classify_emotions_batched(texts, batch_size, classifier=None):
+    """
+    Runs the NLI model over every (entry, label hypothesis) pair in padded batches.
+    Pairs are ordered by entry token length so each batch pads to a similar length.
+    Returns the top label for each text, in input order.
+    """
+    import numpy as np
+    import torch
+
+    classifier = classifier or get_emotion_classifier()
+    tokenizer, model = classifier.tokenizer, classifier.model
+    entailment_id = classifier.entailment_id
+    hypotheses = [HYPOTHESIS_TEMPLATE.format(label) for label in EMOTION_LABELS]
+    n_labels = len(hypotheses)
+
+    lengths = [len(ids) for ids in tokenizer(texts, truncation=True)["input_ids"]]
+    order = sorted(range(len(texts)), key=lengths.__getitem__)
+    pairs = [(i, j) for i in order for j in range(n_labels)]
+
+    entail_logits = np.empty((len(texts), n_labels), dtype=np.float32)
+    with torch.inference_mode():
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            encoded = tokenizer(
+                [texts[i] for i, _ in batch],
+                [hypotheses[j] for _, j in batch],
+                padding=True,
+                truncation="only_first",
+                return_tensors="pt",
+            ).to(model.device)
+            logits = model(**encoded).logits[:, entailment_id].float().cpu().numpy()
+            for (i, j), value in zip(batch, logits):
+                entail_logits[i, j] = value
+
+    # Single-label zero-shot softmaxes the entailment logits across labels,
+    # so the top label is simply the largest entailment logit.
+    return [EMOTION_LABELS[k].capitalize() for k in entail_logits.argmax(axis=1)]
+
+
+def _load_text_embedder():
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    model = AutoModel.from_pretrained(EMBEDDING_MODEL)
+    model.eval()
+    return tokenizer, model
+
+
+register_model("text_embedder", _load_text_embedder)
+
+
+def _encode_texts(texts, batch_size=32):
+    """Mean-pooled, L2-normalized sentence embeddings as a float32 (n, dim) array."""
+    import numpy as np
+    import torch
+
+    tokenizer, model = get_model("text_embedder")
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    vectors = np.empty((len(texts), model.config.hidden_size), dtype=np.float32)
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = tokenizer(
+                [texts[i] for i in batch], padding=True, truncation=True, return_tensors="pt"
+            ).to(model.device)
+            hidden = model(**encoded).last_hidden_state
+            mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            vectors[batch] = torch.nn.functional.normalize(pooled, dim=-1).float().cpu().numpy()
+    return vectors
+
+
+def embedding_key(text):
+    """Content address of an entry embedding: hash of the embedding model and normalized text."""
+    payload = "\x1f".join([EMBEDDING_MODEL, _normalize_text(text)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def embed_texts(texts, batch_size=32):
+    """
+    Returns unit-length embeddings (n, dim) for texts.
+    Vectors are stored in the entry_embeddings table, so each distinct text is
+    embedded once and other features (similarity, reflection cache) can reuse it.
+    """
+    import numpy as np
+
+    texts = list(texts)
+    keys = [embedding_key(text) for text in texts]
+    try:
+        stored = get_embeddings(keys)
+    except sqlite3.Error:
+        stored = {}
+
+    missing = [i for i, key in enumerate(keys) if key not in stored]
+    computed = {}
+    if missing:
+        vectors = _encode_texts([texts[i] for i in missing], batch_size=batch_size)
+        computed = dict(zip(missing, vectors))
+        try:
+            put_embeddings([(keys[i], EMBEDDING_MODEL, computed[i].tobytes()) for i in missing])
+        except sqlite3.Error:
+            pass
+
+    return np.stack([
+        computed[i] if i in computed else np.frombuffer(stored[keys[i]], dtype=np.float32)
+        for i in range(len(texts))
+    ]) if texts else np.empty((0, 0), dtype=np.float32)
+
+
+def _load_label_prototypes():
+    """
+    One unit vector per label, the mean embedding of the label and its example phrases.
+    Saved to disk under a hash of the model, labels and phrases, so it is computed only once.
+    """
+    import numpy as np
+
+    phrases = [[f"I feel {label}."] + EMOTION_PROTOTYPES.get(label, []) for label in EMOTION_LABELS]
+    digest = hashlib.sha256(json.dumps([EMBEDDING_MODEL, EMOTION_LABELS, phrases]).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(EMBEDDING_CACHE_DIR, f"emotion_prototypes_{digest}.npy")
+    if os.path.exists(path):
+        return np.load(path)
+
+    prototypes = []
+    for label_phrases in phrases:
+        centroid = _encode_texts(label_phrases).mean(axis=0)
+        prototypes.append(centroid / np.linalg.norm(centroid))
+    prototypes = np.stack(prototypes).astype(np.float32)
+
+    os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+    np.save(path, prototypes)
+    return prototypes
+
+
+register_model("emotion_prototypes", _load_label_prototypes)
+
+
+def _classify_emotions_embedding(texts):
+    """One embedding pass per entry, then cosine similarity against the label prototypes."""
+    scores = embed_texts(texts) @ get_model("emotion_prototypes").T
+    return [EMOTION_LABELS[k].capitalize() for k in scores.argmax(axis=1)]
+
+
+def analyze_emotions(texts, batch_size=64, use_cache=True):
+    """
+    Batched version of analyze_emotion for bulk ingestion and re-scoring.
+    batch_size is the number of (entry, label) pairs per forward pass.
+    Returns a list of (sentiment, emotion) tuples in the same order as texts.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+
+    keys = [analysis_cache_key(text) for text in texts] if use_cache else None
+    results = _cache_lookup(keys) if use_cache else {}
+
+    pending = [i for i in range(len(texts)) if not use_cache or keys[i] not in results]
+    if pending:
+        pending_texts = [texts[i] for i in pending]
+        sentiments = [TextBlob(text).sentiment.polarity for text in pending_texts]
+        if EMOTION_CLASSIFIER == "embedding":
+            emotions = _classify_emotions_embedding(pending_texts)
+        else:
+            emotions = _classify_emotions_batched(pending_texts, batch_size)
+        computed = dict(zip(pending, zip(sentiments, emotions)))
+        if use_cache:
+            _cache_store([(keys[i], *computed[i]) for i in pending])
+    else:
+        computed = {}
+
+    return [computed[i] if i in computed else tuple(results[keys[i]]) for i in range(len(texts))]
+
+
+def rescore_journal(batch_size=64, chunk_size=512):
+    """
+    Re-runs sentiment and emotion analysis over every saved entry,
+    e.g. after a change to EMOTION_LABELS or the model. Returns the number of rows updated.
+    """
+    updated = 0
+    for rows in iter_entry_texts(chunk_size=chunk_size):
+        ids = [row_id for row_id, _ in rows]
+        results = analyze_emotions([text or "" for _, text in rows], batch_size=batch_size, use_cache=False)
+        update_analysis(
+            [(sentiment, emotion, row_id) for row_id, (sentiment, emotion) in zip(ids, results)], refresh=False
+        )
+        updated += len(rows)
+        print(f"✓ Re-scored {updated} entries")
+    if updated:
+        # Once for the whole rescore: aggregates read every entry, and a version bump drops caches
+        refresh_analysis()
+    return updated
+
+
 def get_emotion_category(emotion):
     """
     Groups emotions into broader categories for pattern analysis.
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_engine import stream_reflection
+from config import PIPELINE_WORKERS
+from database import insert_entry
+from emotion_analysis import analyze_emotion
+from model_registry import sys_state
+from utils import crisis_detect, get_similar_entries
+
+# Process-wide worker pool and timing history, anchored on ``sys`` like the model registry
+# so that Streamlit re-runs share one pool instead of starting a new one per run.
+_STATE_ATTR = "_reflectai_journal_pipeline"
+
+# Completed submissions kept for pipeline_stats()
+TIMING_HISTORY = 100
+
+STAGES = ("emotion", "crisis", "similar", "reflection", "save")
+
+# Similar past entries shown per submission
+SIMILAR_COUNT = 3
+
+
+def _new_state():
+    return {
+        "lock": threading.Lock(),
+        "executor": ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="journal-pipeline"),
+        "history": deque(maxlen=TIMING_HISTORY),
+    }
+
+
+def _state():
+    return sys_state(_STATE_ATTR, _new_state)
+
+
+class JournalSubmission:
+    """
+    One Journal submission with its independent stages overlapped.
+
+    Creating it starts emotion analysis, crisis detection and the similar-entry lookup on
+    the shared worker pool. The reflection stream waits only for the emotion stage and is
+    consumed on the caller's thread so the UI can render it, while the similarity search
+    keeps running in the background. The lookup may run after save() has added the entry
+    to the similarity index, so it asks for one extra match and similar() drops the saved
+    entry itself.
+
+    Every stage records when it started and how long it took, relative to the submission;
+    call finish() once done to get the timings and add them to pipeline_stats().
+    """
+
+    def __init__(self, entry, executor=None):
+        self.entry = entry
+        self._start = time.perf_counter()
+        self._timings = {}
+        self._timings_lock = threading.Lock()
+        self._finished = False
+        self._saved_id = None
+        executor = executor or _state()["executor"]
+        self._emotion = executor.submit(self._timed, "emotion", analyze_emotion, entry)
+        self._crisis = executor.submit(self._timed, "crisis", crisis_detect, entry)
+        self._similar = executor.submit(self._timed, "similar", get_similar_entries, entry, top_n=SIMILAR_COUNT + 1)
+
+    def _record(self, stage, started, **extra):
+        ended = time.perf_counter()
+        with self._timings_lock:
+            self._timings[stage] = {
+                "start_ms": round((started - self._start) * 1000, 1),
+                "ms": round((ended - started) * 1000, 1),
+                **extra,
+            }
+
+    def _timed(self, stage, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._record(stage, started)
+
+    def analysis(self):
+        """Returns (sentiment, emotion), waiting for the emotion stage if it is still running."""
+        return self._emotion.result()
+
+    def crisis(self):
+        """Returns the crisis level ('critical', 'high', 'moderate') or None."""
+        return self._crisis.result()
+
+    def reflection(self, past_patterns=None):
+        """
+        Streams the reflection once the emotion stage is done; yields the same events as
+        ai_engine.stream_reflection. first_chunk_ms in the timings is when the first piece
+        of reflection text arrived.
+        """
+        sentiment, emotion = self.analysis()
+        started = time.perf_counter()
+        first_chunk = None
+        try:
+            for event, value in stream_reflection(self.entry, emotion, sentiment, past_patterns):
+                if event == "delta" and first_chunk is None:
+                    first_chunk = round((time.perf_counter() - self._start) * 1000, 1)
+                yield event, value
+        finally:
+            self._record("reflection", started, first_chunk_ms=first_chunk)
+
+    def save(self, record):
+        """Inserts the entry; returns its id."""
+        self._saved_id = self._timed("save", insert_entry, record)
+        return self._saved_id
+
+    def similar(self):
+        """Returns the similar past entries (a DataFrame, or [] when there are none), never the saved entry."""
+        similar = self._similar.result()
+        if len(similar) == 0:
+            return similar
+        if self._saved_id is not None:
+            similar = similar[similar["id"] != self._saved_id]
+        return similar.head(SIMILAR_COUNT) if len(similar) else []
+
+    def finish(self):
+        """
+        Returns {stage: {start_ms, ms, ...}, "total_ms": ...} for the stages that ran and
+        records them for pipeline_stats(). Stages still running in the background are left out.
+        """
+        with self._timings_lock:
+            timings = {stage: dict(info) for stage, info in self._timings.items()}
+        timings["total_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+        if not self._finished:
+            self._finished = True
+            state = _state()
+            with state["lock"]:
+                state["history"].append(timings)
+        return timings
+
+
+def pipeline_stats():
+    """
+    Returns mean timings over the last TIMING_HISTORY submissions:
+    {"submissions": n, "total_ms": mean, "stages": {stage: {"runs", "start_ms", "ms"}}}.
+    """
+    state = _state()
+    with state["lock"]:
+        history = list(state["history"])
+    if not history:
+        return {"submissions": 0, "total_ms": None, "stages": {}}
+
+    stages = {}
+    for stage in STAGES:
+        runs = [timings[stage] for timings in history if stage in timings]
+        if runs:
+            stages[stage] = {
+                "runs": len(runs),
+                "start_ms": round(sum(run["start_ms"] for run in runs) / len(runs), 1),
+                "ms": round(sum(run["ms"] for run in runs) / len(runs), 1),
+            }
+    return {
+        "submissions": len(history),
+        "total_ms": round(sum(timings["total_ms"] for timings in history) / len(history), 1),
+        "stages": stages,
+    }
@@ -0,0 +1,168 @@
+import os
+import sys
+import threading
+import time
+
+# Process-wide registry state. It is anchored on the ``sys`` module rather than
+# on this module's globals so that a re-import (e.g. Streamlit reloading the
+# script's dependencies) still sees the models that are already in memory.
+_STATE_ATTR = "_reflectai_model_registry"
+
+# Serialises the first creation of every sys_state(); created with setdefault on ``sys`` so
+# that a reload of this module still uses the same lock.
+_SYS_STATE_LOCK = sys.__dict__.setdefault("_reflectai_sys_state_lock", threading.Lock())
+
+
+def sys_state(name, factory):
+    """
+    Returns the process-wide state stored on ``sys`` under name, creating it with factory()
+    on first use. Concurrent first calls (several Streamlit sessions starting at once) all
+    get the same state, and factory() runs only once.
+    """
+    state = getattr(sys, name, None)
+    if state is None:
+        with _SYS_STATE_LOCK:
+            state = getattr(sys, name, None)
+            if state is None:
+                state = factory()
+                setattr(sys, name, state)
+    return state
+
+
+def _new_state():
+    return {
+        "lock": threading.Lock(),
+        "models": {},
+        "loaders": {},
+        "locks": {},
+        "stats": {},
+        "warmup_threads": {},
+    }
+
+
+def _state():
+    return sys_state(_STATE_ATTR, _new_state)
+
+
+def _resident_memory_mb():
+    """
+    Returns the current resident set size of this process in MB,
+    or None if it cannot be determined on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in KB elsewhere
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def register_model(name, loader):
+    """
+    Registers a zero-argument loader for a model. Nothing is loaded until
+    get_model(name) is called for the first time.
+    """
+    state = _state()
+    with state["lock"]:
+        state["loaders"].setdefault(name, loader)
+        state["locks"].setdefault(name, threading.Lock())
+
+
+def get_model(name):
+    """
+    Returns the shared instance of a registered model, loading it on first use.
+    Concurrent callers block on the same load instead of loading twice.
+    """
+    state = _state()
+    model = state["models"].get(name)
+    if model is not None:
+        return model
+
+    with state["lock"]:
+        if name not in state["loaders"]:
+            raise KeyError(f"No model registered under '{name}'")
+        model_lock = state["locks"][name]
+
+    with model_lock:
+        model = state["models"].get(name)
+        if model is not None:
+            return model
+
+        memory_before = _resident_memory_mb()
+        start = time.perf_counter()
+        model = state["loaders"][name]()
+        load_seconds = time.perf_counter() - start
+        memory_after = _resident_memory_mb()
+
+        state["stats"][name] = {
+            "load_seconds": round(load_seconds, 2),
+            "rss_before_mb": round(memory_before, 1) if memory_before is not None else None,
+            "rss_after_mb": round(memory_after, 1) if memory_after is not None else None,
+            "rss_delta_mb": (
+                round(memory_after - memory_before, 1)
+                if memory_before is not None and memory_after is not None else None
+            ),
+            "loaded_at": time.time(),
+            # Set by loaders that can fall back to another backend than the configured one
+            "backend": getattr(model, "loaded_backend", None),
+        }
+        state["models"][name] = model
+
+    stats = state["stats"][name]
+    print(f"✓ Loaded model '{name}' in {stats['load_seconds']}s (RSS delta: {stats['rss_delta_mb']} MB)")
+    return model
+
+
+def is_loaded(name):
+    return name in _state()["models"]
+
+
+def warm_up(name, background=True):
+    """
+    Loads a registered model ahead of the first request.
+    With background=True the load runs in a daemon thread and this returns
+    immediately; calling it again while a warm-up is running is a no-op.
+    """
+    state = _state()
+    if not background:
+        return get_model(name)
+
+    with state["lock"]:
+        if name in state["models"]:
+            return None
+        thread = state["warmup_threads"].get(name)
+        if thread is not None and thread.is_alive():
+            return thread
+
+        def _load():
+            try:
+                get_model(name)
+            except Exception as e:
+                print(f"⚠️ Warm-up of model '{name}' failed: {e}")
+
+        thread = threading.Thread(target=_load, name=f"warmup-{name}", daemon=True)
+        state["warmup_threads"][name] = thread
+        thread.start()
+        return thread
+
+
+def model_stats():
+    """
+    Returns load statistics for every registered model, plus current process RSS.
+    """
+    state = _state()
+    return {
+        "process_rss_mb": _resident_memory_mb(),
+        "models": {
+            name: {"loaded": name in state["models"], **state["stats"].get(name, {})}
+            for name in state["loaders"]
+        },
+    }
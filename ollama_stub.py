@@ -0,0 +1,156 @@
+"""
+Minimal stand-in for the Ollama REST API, for running ReflectAI's Ollama backend offline.
+
+It answers /api/generate (streaming and non-streaming) with a canned reflection and /api/tags
+with the configured model, speaks HTTP/1.1 keep-alive, and counts the TCP connections it
+accepted so connection reuse can be checked.
+
+Usage:
+    python ollama_stub.py [--port 11434] [--token-delay 0.0]
+
+Or from Python:
+    server = start_stub_server()   # random free port, runs in a daemon thread
+    set_providers([OllamaProvider(url=server.url)])
+    server.shutdown()
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import OLLAMA_MODEL
+
+CANNED_REFLECTION = {
+    "reflection": "It sounds like today asked a lot of you. Feeling this way makes sense given everything you are carrying.",
+    "summary": "Carrying a heavy load today",
+    "actionable_insight": "Pick one small task and give it ten focused minutes.",
+    "followups": [
+        {"question": "What felt heaviest today?", "follow_up": "Naming it makes it easier to address."},
+        {"question": "What helped even a little?", "follow_up": "Small supports are worth repeating."},
+    ],
+    "tone": "warm and grounding",
+    "safety_flag": False,
+    "coping_suggestion": "Try box breathing: in for 4, hold for 4, out for 4, hold for 4.",
+}
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections open between requests
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": self.server.model, "model": self.server.model}]})
+        elif self.path == "/stub/stats":
+            with self.server.stats_lock:
+                self._send_json(dict(self.server.stats))
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json({"error": "invalid JSON body"}, status=400)
+            return
+        if self.path != "/api/generate":
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+            self.server.stats["last_request"] = request
+
+        text = json.dumps(self.server.reflection, indent=2)
+        created_at = datetime.now(timezone.utc).isoformat()
+        done = {
+            "model": request.get("model", self.server.model), "created_at": created_at,
+            "response": "", "done": True, "done_reason": "stop",
+            "eval_count": len(text) // 4,
+        }
+
+        if not request.get("stream", True):
+            time.sleep(self.server.token_delay * len(text) / 4)
+            self._send_json({**done, "response": text})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # Roughly token-sized pieces, like the real server
+        try:
+            for start in range(0, len(text), 4):
+                time.sleep(self.server.token_delay)
+                self._send_chunk({
+                    "model": done["model"], "created_at": created_at,
+                    "response": text[start:start + 4], "done": False,
+                })
+            self._send_chunk(done)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (a cancelled request), as the real server allows
+            self.close_connection = True
+
+
+def start_stub_server(host="127.0.0.1", port=0, token_delay=0.0, model=OLLAMA_MODEL, reflection=None):
+    """
+    Starts the stub in a daemon thread and returns the server; server.url is its base URL.
+    token_delay is the pause (seconds) before each ~4-character chunk of the response.
+    """
+    server = ThreadingHTTPServer((host, port), OllamaStubHandler)
+    server.daemon_threads = True
+    server.model = model
+    server.token_delay = token_delay
+    server.reflection = reflection or CANNED_REFLECTION
+    server.stats = {"connections": 0, "requests": 0, "last_request": None}
+    server.stats_lock = threading.Lock()
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name="ollama-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline stand-in for the Ollama REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="seconds to wait before each streamed chunk")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.host, args.port, args.token_delay)
+    print(f"✓ Ollama stub listening on {server.url} (model '{server.model}')")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from config import (
+    EMBEDDING_MODEL, REFLECTION_CACHE, REFLECTION_CACHE_TTL_HOURS, REFLECTION_CACHE_MAX_ENTRIES,
+    REFLECTION_CACHE_NEAR_DUPLICATES, REFLECTION_CACHE_SIMILARITY
+)
+from database import (
+    get_cached_reflection, get_reflection_vectors, put_cached_reflection, reflection_cache_size
+)
+
+# Process-wide counters; saved_ms adds up the original generation time of every hit
+_stats = {"hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0, "saved_ms": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def _normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def reflection_scope(emotion, band, model, template_version):
+    """
+    Everything besides the entry that shapes a reflection: the emotion, the prompt's sentiment
+    band, the provider models and the prompt template version. Near-duplicate matches are
+    only looked for within the same scope, which therefore also names the EMBEDDING_MODEL
+    the stored vectors came from.
+    """
+    return "\x1f".join([emotion.lower(), band, model, str(template_version), EMBEDDING_MODEL])
+
+
+def reflection_key(entry, scope):
+    """Content address of a cached reflection: hash of the scope and the normalized entry."""
+    payload = "\x1f".join([scope, _normalize_text(entry)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _min_created():
+    return time.time() - REFLECTION_CACHE_TTL_HOURS * 3600
+
+
+def _entry_vector(entry):
+    # Imported here so the exact-match cache doesn't load the embedding stack
+    from emotion_analysis import embed_texts
+    return embed_texts([entry])[0]
+
+
+def _nearest(entry, scope, min_created):
+    """Returns the key of the most similar cached entry in scope above the threshold, or None."""
+    import numpy as np
+
+    rows = get_reflection_vectors(scope, min_created)
+    if not rows:
+        return None
+    query = _entry_vector(entry)
+    # Rows stored by a different embedding model of another size can't be compared
+    rows = [(key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows]
+    rows = [(key, vector) for key, vector in rows if vector.shape == query.shape]
+    if not rows:
+        return None
+    scores = np.stack([vector for _, vector in rows]) @ query
+    best = int(scores.argmax())
+    return rows[best][0] if scores[best] >= REFLECTION_CACHE_SIMILARITY else None
+
+
+def lookup(entry, scope):
+    """
+    Returns the cached response dict for this entry and scope, or None.
+
+    With REFLECTION_CACHE_NEAR_DUPLICATES on, an entry whose embedding has cosine similarity
+    of at least REFLECTION_CACHE_SIMILARITY to a cached entry of the same scope reuses its
+    reflection too.
+    """
+    if not REFLECTION_CACHE:
+        return None
+    min_created = _min_created()
+    # The cache is an optimisation only; a missing table, locked DB or failing embedding
+    # model counts as a miss
+    try:
+        row = get_cached_reflection(reflection_key(entry, scope), min_created)
+        kind = "hits"
+        if row is None and REFLECTION_CACHE_NEAR_DUPLICATES:
+            nearest = _nearest(entry, scope, min_created)
+            if nearest is not None:
+                row = get_cached_reflection(nearest, min_created)
+                kind = "near_hits"
+    except Exception as e:
+        print(f"⚠️ Reflection cache lookup failed: {e}")
+        row = None
+
+    if row is None:
+        _count(misses=1)
+        return None
+    response_json, latency_ms = row
+    _count(**{kind: 1, "saved_ms": latency_ms or 0.0})
+    return json.loads(response_json)
+
+
+def store(entry, scope, response, latency_ms):
+    """Caches a successfully generated response; latency_ms is what a later hit saves."""
+    if not REFLECTION_CACHE:
+        return
+    # Never lets a cache failure lose the reflection that was just generated
+    try:
+        vector = _entry_vector(entry).tobytes() if REFLECTION_CACHE_NEAR_DUPLICATES else None
+        expired, evicted = put_cached_reflection(
+            reflection_key(entry, scope), scope, json.dumps(response), latency_ms, vector,
+            _min_created(), REFLECTION_CACHE_MAX_ENTRIES
+        )
+    except Exception as e:
+        print(f"⚠️ Reflection cache store failed: {e}")
+        return
+    _count(stores=1, expired=expired, evictions=evicted)
+
+
+def reflection_cache_stats():
+    """Returns the counters for this process, the hit rate and the number of cached reflections."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] + stats["near_hits"]) / lookups if lookups else 0.0
+    stats["saved_ms"] = round(stats["saved_ms"], 1)
+    try:
+        stats["entries"] = reflection_cache_size()
+    except sqlite3.Error:
+        stats["entries"] = None
+    return stats
@@ -0,0 +1,245 @@
+import os
+import pickle
+import threading
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import database
+from config import SIMILARITY_REBUILD_RATIO, SIMILARITY_MIN_REBUILD
+
+
+def _index_path():
+    # Stored next to the database so each journal file has its own index
+    return os.path.splitext(database.DB_FILE)[0] + ".similarity.pkl"
+
+
+class SimilarityIndex:
+    """
+    Persistent TF-IDF index over journal entries.
+
+    The vocabulary and IDF weights are fitted on a full rebuild and then frozen:
+    new entries are transformed with the fitted vectorizer and appended, which keeps
+    an insert O(entry length). Once enough entries were added since the last fit
+    (SIMILARITY_REBUILD_RATIO), a background rebuild refits on the whole corpus.
+
+    Rows are L2-normalized, so cosine similarity is a dot product. Exact queries use a
+    term-major (CSC) copy of the matrix, i.e. an inverted index: only the postings of
+    the query's terms are touched.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or _index_path()
+        self.vectorizer = None
+        self.matrix = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.fitted_count = 0
+        self._pending_ids = []
+        self._pending_rows = []
+        self._postings = None
+        self._lock = threading.RLock()
+        self._rebuild_thread = None
+
+    def __len__(self):
+        return len(self.ids) + len(self._pending_ids)
+
+    @property
+    def max_id(self):
+        if self._pending_ids:
+            return self._pending_ids[-1]
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    # ---------- building & persistence ----------
+
+    def build(self):
+        """Fits the vectorizer on every saved entry and replaces the index."""
+        ids, texts = [], []
+        for rows in database.iter_entry_texts(chunk_size=2000):
+            for row_id, text in rows:
+                ids.append(row_id)
+                texts.append(text or "")
+        self.fit(ids, texts)
+        self.save()
+
+    def fit(self, ids, texts, catch_up=True):
+        """
+        Fits the index on (ids, texts) given in id order. With catch_up, entries saved to
+        the database after the last of these ids are appended as well.
+        """
+        vectorizer, matrix = None, None
+        if texts:
+            vectorizer = TfidfVectorizer(stop_words='english', min_df=1)
+            try:
+                matrix = vectorizer.fit_transform(texts).tocsr()
+            except ValueError:
+                # Every entry is empty or stop words only
+                vectorizer, matrix = None, None
+
+        with self._lock:
+            self.vectorizer = vectorizer
+            self.matrix = matrix
+            self.ids = np.asarray(ids if matrix is not None else [], dtype=np.int64)
+            self.fitted_count = len(self.ids)
+            self._pending_ids, self._pending_rows = [], []
+            self._postings = None
+            if vectorizer is not None and catch_up:
+                # Entries saved while we were fitting are transformed with the new vocabulary
+                self._catch_up()
+
+    def save(self):
+        with self._lock:
+            self._merge_pending()
+            state = {
+                "vectorizer": self.vectorizer,
+                "matrix": self.matrix,
+                "ids": self.ids,
+                "fitted_count": self.fitted_count,
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Loads the saved index and catches up with entries saved since. Returns False if there is none."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return False
+
+        with self._lock:
+            self.vectorizer = state["vectorizer"]
+            self.matrix = state["matrix"]
+            self.ids = state["ids"]
+            self.fitted_count = state["fitted_count"]
+            if self.vectorizer is not None:
+                self._catch_up()
+        if self.vectorizer is None or self._should_rebuild():
+            self.rebuild_async()
+        return True
+
+    def _catch_up(self):
+        # Caller holds the lock
+        for rows in database.iter_entry_texts(chunk_size=2000, after_id=self.max_id):
+            for row_id, text in rows:
+                self._append(row_id, text)
+
+    # ---------- incremental updates ----------
+
+    def add(self, row_id, text):
+        """Adds one entry using the frozen vocabulary; schedules a rebuild when it has drifted."""
+        with self._lock:
+            if row_id <= self.max_id:
+                # Already picked up by a rebuild or catch-up
+                return
+            needs_build = self.vectorizer is None
+            if not needs_build:
+                self._append(row_id, text)
+        if needs_build or self._should_rebuild():
+            self.rebuild_async()
+
+    def _append(self, row_id, text):
+        # Caller holds the lock
+        self._pending_ids.append(int(row_id))
+        self._pending_rows.append(self.vectorizer.transform([text or ""]))
+
+    def _merge_pending(self):
+        # Caller holds the lock. One vstack per batch of inserts rather than per insert.
+        if not self._pending_rows:
+            return
+        blocks = ([self.matrix] if self.matrix is not None else []) + self._pending_rows
+        self.matrix = sp.vstack(blocks, format="csr")
+        self.ids = np.concatenate([self.ids, np.asarray(self._pending_ids, dtype=np.int64)])
+        self._pending_ids, self._pending_rows = [], []
+
+    def _should_rebuild(self):
+        added = len(self) - self.fitted_count
+        return added >= max(SIMILARITY_MIN_REBUILD, SIMILARITY_REBUILD_RATIO * self.fitted_count)
+
+    def rebuild_async(self):
+        """Refits the index in a background thread; no-op if a rebuild is already running."""
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return self._rebuild_thread
+
+            def _rebuild():
+                try:
+                    self.build()
+                except Exception as e:
+                    print(f"⚠️ Similarity index rebuild failed: {e}")
+
+            self._rebuild_thread = threading.Thread(target=_rebuild, name="similarity-rebuild", daemon=True)
+            self._rebuild_thread.start()
+            return self._rebuild_thread
+
+    # ---------- queries ----------
+
+    def snapshot(self):
+        """Returns (vectorizer, matrix, ids) for a consistent lock-free query."""
+        with self._lock:
+            self._merge_pending()
+            return self.vectorizer, self.matrix, self.ids
+
+    def _exact_scores(self, matrix, q):
+        with self._lock:
+            postings, n_indexed = self._postings or (None, 0)
+            tail = matrix.shape[0] - n_indexed
+            # Re-pivot once the un-pivoted tail is large; until then the tail is scored row-wise
+            if postings is None or tail < 0 or tail > max(1000, 0.1 * n_indexed):
+                postings, n_indexed = matrix.tocsc(), matrix.shape[0]
+                self._postings = (postings, n_indexed)
+
+        scores = np.empty(matrix.shape[0])
+        scores[:n_indexed] = postings[:, q.indices] @ q.data
+        if n_indexed < matrix.shape[0]:
+            scores[n_indexed:] = (matrix[n_indexed:] @ q.T).toarray().ravel()
+        return scores
+
+    def query(self, text, top_n=3, exclude_ids=None):
+        """
+        Returns [(row_id, score), ...] for the top_n most similar entries, best first.
+        Every entry is scored exactly through the inverted index.
+        """
+        vectorizer, matrix, ids = self.snapshot()
+        if vectorizer is None or matrix is None or matrix.shape[0] == 0:
+            return []
+
+        q = vectorizer.transform([text])
+        scores = self._exact_scores(matrix, q)
+        if exclude_ids:
+            scores[np.isin(ids, list(exclude_ids))] = -np.inf
+
+        k = min(top_n, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Returns the process-wide index for the current DB_FILE, loading or building it on first use."""
+    global _index
+    with _index_lock:
+        if _index is None or _index.path != _index_path():
+            index = SimilarityIndex()
+            if not index.load():
+                index.build()
+            _index = index
+        return _index
+
+
+def _on_insert(row_id, data):
+    # Only maintain an index that is already in memory; otherwise it catches up on load
+    with _index_lock:
+        index = _index if _index is not None and _index.path == _index_path() else None
+    if index is not None:
+        index.add(row_id, data.get("entry", ""))
+
+
+database.register_insert_hook(_on_insert)
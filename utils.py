@@ -1,43 +1,191 @@
+import re
 from config import CRISIS_WORDS
-from sklearn.feature_extraction.text import TfidfVectorizer
+from database import load_entries_by_ids, sentiment_buckets
+from similarity_index import get_index
+from sklearn.feature_extraction.text import TfidfVectorizer, ENGLISH_STOP_WORDS
 from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
 import pandas as pd
-from collections import Counter
+from collections import Counter, namedtuple
 
 # Enhanced crisis detection keywords
 CRISIS_KEYWORDS = {
-    "self_harm": ["cutting", "self harm", "hurt myself", "starving", "overdose", "harm myself", "slice", "bleed"],
-    "suicidal": ["suicide", "kill myself", "end it", "no point", "no reason to live", "better off dead"],
+    # "slice" only in self-directed phrases, so "a slice of pizza" isn't flagged
+    "self_harm": ["cutting", "self harm", "hurt myself", "starving", "overdose", "harm myself", "bleed",
+                  "slice my", "slice myself", "slicing my", "slit my", "slit my wrists"],
+    "suicidal": ["suicide", "kill myself", "end it", "no point", "no reason to live", "better off dead", "want to die"],
     "hopelessness": ["everything's pointless", "give up", "can't take it", "never get better", "hopeless", "worthless"],
     "acute_distress": ["panicking", "can't breathe", "losing it", "falling apart", "breaking down", "freaking out"],
     "substance_abuse": ["drinking to forget", "high all day", "need drugs", "substance", "intoxicated"],
 }
 
-def crisis_detect(text):
+# Severity of each keyword category. Words from config.CRISIS_WORDS that are not listed
+# above (and don't contain a listed keyword) are reported as "general" but don't raise severity.
+CRISIS_SEVERITY = {
+    "self_harm": "critical",
+    "suicidal": "critical",
+    "hopelessness": "high",
+    "acute_distress": "high",
+    "substance_abuse": "moderate",
+    "general": None,
+}
+_SEVERITY_RANK = {"critical": 3, "high": 2, "moderate": 1}
+
+
+def _trie_pattern(words, suffix=lambda word: ""):
+    """
+    Builds a prefix-factored regex for a set of literal words, e.g. ["cutting", "can't take it",
+    "can't breathe"] -> "cutting|can't\\ (?:take\\ it|breathe)". The regex engine then
+    follows one branch per character instead of retrying every keyword at every position.
+    suffix(word) is appended where each word ends.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = suffix(word)
+
+    def _render(node):
+        branches = []
+        for ch in sorted(node, key=lambda c: (c == "", c)):
+            branches.append(node[ch] if ch == "" else re.escape(ch) + _render(node[ch]))
+        if len(branches) == 1:
+            return branches[0]
+        if "" in branches:
+            # A keyword ends here but longer ones continue; prefer the longer match
+            return "(?:" + "|".join(b for b in branches if b) + ")?"
+        return "(?:" + "|".join(branches) + ")"
+
+    return _render(trie)
+
+
+def _inflects(keyword):
+    """Keywords ending in a word of 4+ letters also match its inflections ("overdose" -> "overdosed")."""
+    last_word = keyword.split()[-1]
+    return len(last_word) >= 4 and last_word[-1].isalpha()
+
+
+# ASCII separators (everything but letters, digits and "_") become spaces for the fast scan
+_SEPARATORS_TO_SPACE = str.maketrans({chr(i): " " for i in range(128) if not re.match(r"\w", chr(i))})
+
+_CrisisMatcher = namedtuple("_CrisisMatcher", "fast pattern pattern_ignorecase categories stems")
+
+
+def _build_crisis_matcher(word_boundary):
+    """
+    Compiles every crisis keyword into a single prefix-factored regex.
+
+    With word_boundary, `pattern` is "\\W" followed by the keyword trie and is matched against
+    " " + text, so the separator in front of a keyword is part of the match. `fast` is the
+    same trie behind a literal " ", for ASCII text whose separators were all turned into
+    spaces; a literal first character lets the regex engine jump from space to space instead
+    of trying the trie at every position, which is what makes one pattern cheaper than a
+    substring search per keyword. Keywords are recovered from the original text.
+    """
+    categories = {}
+    for category, keywords in CRISIS_KEYWORDS.items():
+        for keyword in keywords:
+            categories.setdefault(keyword.lower(), category)
+    for keyword in CRISIS_WORDS:
+        keyword = keyword.lower()
+        if keyword not in categories:
+            # e.g. "substance abuse" takes the category of "substance"
+            categories[keyword] = next(
+                (c for k, c in categories.items() if re.search(rf"(?<!\w){re.escape(k)}(?!\w)", keyword)),
+                "general"
+            )
+
+    if not word_boundary:
+        trie = _trie_pattern(categories)
+        return _CrisisMatcher(None, re.compile(trie), re.compile(trie, re.IGNORECASE), categories, [])
+
+    # Keywords must start at a word boundary; stems may run on into inflections ("bleeding",
+    # "self harming", "hopelessness"), the rest must end there too. (?!\w) rather than \b so
+    # keywords ending in punctuation still work.
+    def suffix(keyword):
+        return r"\w*" if _inflects(keyword) else r"(?!\w)"
+
+    trie = _trie_pattern(categories, suffix)
+    spaced = {keyword.translate(_SEPARATORS_TO_SPACE): keyword for keyword in categories}
+    fast_trie = _trie_pattern(spaced, lambda spaced_keyword: suffix(spaced[spaced_keyword]))
+    stems = sorted((k for k in categories if _inflects(k)), key=len, reverse=True)
+    return _CrisisMatcher(
+        re.compile(" " + fast_trie), re.compile(r"\W" + trie), re.compile(r"\W" + trie, re.IGNORECASE),
+        categories, stems
+    )
+
+
+_CRISIS_MATCHERS = {
+    True: _build_crisis_matcher(word_boundary=True),
+    False: _build_crisis_matcher(word_boundary=False),
+}
+
+
+def _crisis_keyword(matcher, found):
+    # An inflected match ("bleeding") is reported as the keyword it starts with ("bleed")
+    if found in matcher.categories:
+        return found
+    return next((k for k in matcher.stems if found.startswith(k)), None)
+
+
+def _crisis_matches(matcher, text, word_boundary):
+    """Returns [(keyword, start, end)] for every keyword in text, in order."""
+    lowered = text.lower()
+    if not word_boundary:
+        # Matching pre-lowercased text is about twice as fast as IGNORECASE, but only
+        # keeps spans aligned when lowercasing doesn't change the length.
+        if len(lowered) == len(text):
+            return [(m.group(), m.start(), m.end()) for m in matcher.pattern.finditer(lowered)]
+        return [(m.group().lower(), m.start(), m.end()) for m in matcher.pattern_ignorecase.finditer(text)]
+
+    # Offsets in " " + text are one past those in text, and each match starts with its
+    # separator, so a match's keyword spans text[m.start():m.end() - 1]
+    if text.isascii():
+        matches = []
+        for m in matcher.fast.finditer(" " + lowered.translate(_SEPARATORS_TO_SPACE)):
+            keyword = _crisis_keyword(matcher, lowered[m.start():m.end() - 1])
+            if keyword is None:
+                # Matched only because a separator inside it became a space ("kill-myself");
+                # the exact scan below decides what, if anything, matches there
+                break
+            matches.append((keyword, m.start(), m.end() - 1))
+        else:
+            return matches
+
+    if len(lowered) == len(text):
+        found_iter = matcher.pattern.finditer(" " + lowered)
+    else:
+        found_iter = matcher.pattern_ignorecase.finditer(" " + text)
+    return [(_crisis_keyword(matcher, m.group()[1:].lower()), m.start(), m.end() - 1) for m in found_iter]
+
+
+def crisis_scan(text, word_boundary=True):
+    """
+    Scans text for crisis keywords in a single pass.
+    Returns {"severity": 'critical' | 'high' | 'moderate' | None,
+             "matches": [{"keyword", "category", "start", "end"}, ...],
+             "categories": [category, ...]}
+    """
+    matcher = _CRISIS_MATCHERS[word_boundary]
+    # Curly apostrophes are common on phones and would otherwise miss "can't"-style keywords
+    text = text.replace("\u2019", "'").replace("\u2018", "'")
+    matches = [
+        {"keyword": keyword, "category": matcher.categories[keyword], "start": start, "end": end}
+        for keyword, start, end in _crisis_matches(matcher, text, word_boundary)
+    ]
+
+    found = list(dict.fromkeys(m["category"] for m in matches))
+    severity = max((CRISIS_SEVERITY[c] for c in found if CRISIS_SEVERITY[c]), key=_SEVERITY_RANK.get, default=None)
+    return {"severity": severity, "matches": matches, "categories": found}
+
+
+def crisis_detect(text, word_boundary=True):
     """
     Enhanced crisis detection with severity levels.
     Returns: 'critical', 'high', 'moderate', or None
     """
-    text_lower = text.lower()
-    
-    # Check critical keywords first
-    critical_keywords = CRISIS_KEYWORDS["self_harm"] + CRISIS_KEYWORDS["suicidal"]
-    for keyword in critical_keywords:
-        if keyword in text_lower:
-            return "critical"
-    
-    # Check high-risk keywords
-    high_risk = CRISIS_KEYWORDS["hopelessness"] + CRISIS_KEYWORDS["acute_distress"]
-    for keyword in high_risk:
-        if keyword in text_lower:
-            return "high"
-    
-    # Check moderate-risk keywords
-    for keyword in CRISIS_KEYWORDS["substance_abuse"]:
-        if keyword in text_lower:
-            return "moderate"
-    
-    return None
+    return crisis_scan(text, word_boundary=word_boundary)["severity"]
 
 
 def compute_similarity(new_entry, old_entries):
@@ -51,17 +199,30 @@ def compute_similarity(new_entry, old_entries):
     return sim_scores
 
 
-def get_similar_entries(current_text, df, top_n=3):
+def get_similar_entries(current_text, df=None, top_n=3, exclude_ids=None):
     """
     Finds similar entries based on TF-IDF cosine similarity.
+    Uses the persistent similarity index over the whole journal; pass df to
+    compute an exact, freshly fitted similarity over just those rows instead.
     """
-    if len(df) < 3:
+    similar_columns = ["timestamp", "entry", "emotion", "sentiment"]
+    if df is not None:
+        if len(df) < 3:
+            return []
+        old_entries = df["entry"].tolist()
+        scores = compute_similarity(current_text, old_entries)
+        top_indices = scores.argsort()[-top_n:][::-1]
+        similar = df.iloc[top_indices][similar_columns]
+        return similar
+
+    index = get_index()
+    if len(index) < 3:
         return []
-    old_entries = df["entry"].tolist()
-    scores = compute_similarity(current_text, old_entries)
-    top_indices = scores.argsort()[-top_n:][::-1]
-    similar = df.iloc[top_indices][["timestamp", "entry", "emotion", "sentiment"]]
-    return similar
+    matches = index.query(current_text, top_n=top_n, exclude_ids=exclude_ids)
+    if not matches:
+        return []
+    similar = load_entries_by_ids([row_id for row_id, _ in matches])
+    return similar[["id"] + similar_columns]
 
 
 def get_emotion_patterns(df):
@@ -95,44 +256,166 @@ def get_emotion_patterns(df):
     }
 
 
-def get_sentiment_trends(df):
+def get_emotion_patterns_from_aggregates(agg):
     """
-    Returns weekly sentiment trends for visualization.
+    Same result as get_emotion_patterns, built from database.get_aggregates()
+    instead of a scan over every entry.
+    """
+    total = agg["sentiment"]["count"]
+    if not total:
+        return {}
+
+    emotion_counts = {
+        emotion: sum(bands.values()) for emotion, bands in agg["emotion_bands"].items()
+    }
+    combos = {
+        f"{emotion} + {band}": count
+        for emotion, bands in agg["emotion_bands"].items()
+        for band, count in bands.items()
+    }
+    return {
+        "emotion_frequency": dict(sorted(emotion_counts.items(), key=lambda kv: (-kv[1], kv[0]))),
+        "sentiment_stats": {
+            key: agg["sentiment"][key] for key in ("average", "highest", "lowest", "std_dev")
+        },
+        "common_combinations": dict(sorted(combos.items(), key=lambda kv: (-kv[1], kv[0]))[:5]),
+        "total_entries": total
+    }
+
+
+# Trend granularities: resample rule and bucket labelling (weeks are ISO weeks, labelled by their Monday)
+TREND_FREQS = {
+    "D": ("D", {}),
+    "W": ("W-MON", {"label": "left", "closed": "left"}),
+    "M": ("MS", {}),
+}
+TREND_COLUMNS = ["mean", "min", "max", "count", "sum"]
+
+
+def _finish_trends(trends, freq, rolling):
+    # Empty buckets are kept (count 0, NaN mean) so the index is a regular time axis
+    trends = trends.asfreq(TREND_FREQS[freq][0])
+    trends.index.name = "bucket"
+    trends["count"] = trends["count"].fillna(0).astype("int64")
+    trends["sum"] = trends["sum"].fillna(0.0)
+    if rolling:
+        # Entry-weighted: every entry in the window counts once, however the entries fall into buckets
+        window_count = trends["count"].rolling(rolling, min_periods=1).sum()
+        trends["rolling_mean"] = trends["sum"].rolling(rolling, min_periods=1).sum() / window_count.where(window_count > 0)
+    return trends.round(2)
+
+
+def get_sentiment_trends(df, freq="W", rolling=None):
+    """
+    Returns sentiment trends for visualization, one row per day ("D"), ISO week ("W")
+    or month ("M"), indexed by the bucket's start date.
+    Columns: mean, min, max, count, sum, plus rolling_mean over the last `rolling`
+    buckets when rolling is given.
     """
     if df.empty:
         return None
-    
-    df_copy = df.copy()
-    df_copy["timestamp"] = pd.to_datetime(df_copy["timestamp"])
-    df_copy["week"] = df_copy["timestamp"].dt.isocalendar().week
-    
-    weekly_trends = df_copy.groupby("week").agg({
-        "sentiment": ["mean", "min", "max", "count"]
-    }).round(2)
-    
-    return weekly_trends
+    if freq not in TREND_FREQS:
+        raise ValueError(f"freq must be one of {sorted(TREND_FREQS)}")
+
+    # A sentiment series on a datetime index: only these two columns are touched, the frame isn't copied
+    series = pd.Series(df["sentiment"].to_numpy(), index=pd.DatetimeIndex(pd.to_datetime(df["timestamp"], format="ISO8601")))
+    rule, options = TREND_FREQS[freq]
+    trends = series.sort_index().resample(rule, **options).agg(["mean", "min", "max", "count", "sum"])
+    return _finish_trends(trends, freq, rolling)
+
+
+def get_sentiment_trends_sql(freq="W", rolling=None, start=None, end=None):
+    """
+    Same result as get_sentiment_trends, computed inside SQLite so that long histories never
+    have to be loaded into pandas: weeks are read from the per-ISO-week aggregate, days and
+    months (and week windows that don't start on a Monday) use a GROUP BY.
+    """
+    if freq not in TREND_FREQS:
+        raise ValueError(f"freq must be one of {sorted(TREND_FREQS)}")
+    trends = sentiment_buckets(freq, start=start, end=end)
+    if trends.empty:
+        return None
+    return _finish_trends(trends[TREND_COLUMNS], freq, rolling)
 
 
-def get_emotion_triggers(df):
+def emotion_transition_matrix(df):
+    """
+    Counts how often each emotion is directly followed by another, in time order.
+    Returns a square DataFrame: rows are the earlier emotion, columns the next one.
+    """
+    if len(df) < 2:
+        return pd.DataFrame(dtype="int64")
+
+    emotions = df["emotion"]
+    if not df["timestamp"].is_monotonic_increasing:
+        emotions = emotions.iloc[np.argsort(df["timestamp"].to_numpy(), kind="stable")]
+    categorical = pd.Categorical(emotions)
+    codes = categorical.codes.astype(np.int64)
+    k = len(categorical.categories)
+
+    # Each transition is one cell of the k x k matrix; missing emotions (code -1) are skipped
+    valid = (codes[:-1] >= 0) & (codes[1:] >= 0)
+    cells = codes[:-1][valid] * k + codes[1:][valid]
+    counts = np.bincount(cells, minlength=k * k).reshape(k, k)
+    return pd.DataFrame(counts, index=categorical.categories, columns=categorical.categories)
+
+
+def transition_matrix_from_aggregates(agg):
+    """The same matrix as emotion_transition_matrix, built from the materialized transition counts."""
+    if not agg["transitions"]:
+        return pd.DataFrame(dtype="int64")
+    emotions = sorted({e for pair in agg["transitions"] for e in pair})
+    matrix = pd.DataFrame(0, index=emotions, columns=emotions, dtype="int64")
+    for (a, b), count in agg["transitions"].items():
+        matrix.at[a, b] = count
+    return matrix
+
+
+def _top_transitions(matrix, top_n):
+    counts = matrix.stack()
+    counts = counts[counts > 0].sort_values(ascending=False, kind="stable").head(top_n)
+    return {f"{a} → {b}": int(count) for (a, b), count in counts.items()}
+
+
+def get_emotion_triggers(df, top_n=5):
     """
     Identifies patterns: which emotions follow specific emotions?
     Returns most common emotion transitions.
     """
     if len(df) < 2:
         return {}
-    
-    df_sorted = df.sort_values("timestamp").reset_index(drop=True)
-    emotions = df_sorted["emotion"].tolist()
-    
-    transitions = []
-    for i in range(len(emotions) - 1):
-        transitions.append(f"{emotions[i]} → {emotions[i+1]}")
-    
-    transition_counts = Counter(transitions).most_common(5)
-    return {t[0]: t[1] for t in transition_counts}
+    return _top_transitions(emotion_transition_matrix(df), top_n)
 
 
-def get_low_sentiment_context(df, threshold=-0.3):
+def get_emotion_triggers_from_aggregates(agg, top_n=5):
+    """
+    Same result as get_emotion_triggers, read from the materialized transition counts.
+    """
+    if not agg["transitions"]:
+        return {}
+    return _top_transitions(transition_matrix_from_aggregates(agg), top_n)
+
+
+# Words ignored when looking for themes in entries
+STOP_WORDS = ENGLISH_STOP_WORDS | {"feel", "feeling", "felt", "just", "really", "today", "like", "know", "went"}
+_WORD_RE = re.compile(r"[a-z][a-z']+")
+
+
+def count_theme_words(texts, min_length=4):
+    """
+    Counts content words over an iterable of texts, one entry at a time.
+    Words shorter than min_length and STOP_WORDS are skipped.
+    """
+    counts = Counter()
+    for text in texts:
+        counts.update(_WORD_RE.findall(text.lower()))
+    # Filtering once per distinct word is much cheaper than once per occurrence
+    for word in [w for w in counts if len(w) < min_length or w in STOP_WORDS]:
+        del counts[word]
+    return counts
+
+
+def get_low_sentiment_context(df, threshold=-0.3, top_n=10):
     """
     For entries with low sentiment, analyze what might have contributed.
     Returns top words from low-sentiment entries.
@@ -140,18 +423,9 @@ def get_low_sentiment_context(df, threshold=-0.3):
     if df.empty:
         return []
     
-    low_sentiment_entries = df[df["sentiment"] < threshold]
+    low_sentiment_entries = df.loc[df["sentiment"] < threshold, "entry"]
     if low_sentiment_entries.empty:
         return []
     
-    all_text = " ".join(low_sentiment_entries["entry"].tolist())
-    
-    # Simple word frequency (in production, use NLTK for better NLP)
-    from collections import Counter
-    words = all_text.lower().split()
-    # Filter common stop words
-    stop_words = {"the", "a", "an", "and", "or", "but", "in", "on", "at", "to", "for", "is", "are", "was", "were"}
-    filtered_words = [w for w in words if w not in stop_words and len(w) > 3]
-    
-    top_words = Counter(filtered_words).most_common(10)
-    return {word: count for word, count in top_words}
+    counts = count_theme_words(low_sentiment_entries.dropna())
+    return dict(counts.most_common(top_n))